@@ -1,27 +1,36 @@
 import asyncio
 import threading
-import json
 import os
 import sqlite3
-import re
+import time
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import FSInputFile
 
 
-from core.driver.get_playlist_tracks import Startparser
+from core.driver.get_playlist_tracks import format_track
+from core.driver.scrape_service import YANDEX_LINK_PATTERN, UserTasks, scrape_service
+from core.driver.snapshots import is_positional_id, load_snapshot
+from core.driver.track_sink import JsonlTrackSink, TrackFile, index_path
+from core.driver.janitor import Janitor, remove_stale_files, sweep_snapshots
 
 # ----------------- Конфиг -----------------
-TG_TOKEN = "BOT TOKEN"
+TG_TOKEN = os.getenv("BOT1_TOKEN", "BOT TOKEN")
+# Режим парсера (CDP, пул вкладок) и кэш плейлистов — в core/driver/scrape_service.py
 
-# Регулярка для ссылок Яндекс Музыки
-YANDEX_LINK_PATTERN = re.compile(
-    r'https?://music\.yandex\.(ru|com)/playlists/'
-    r'(?:lk\.[a-f0-9\-]+|[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})'
-    r'(?:\?.*)?$',
-    re.IGNORECASE
-)
+# Очистка брошенных данных (секунды)
+JANITOR_INTERVAL = 10 * 60
+TEMP_FILES_TTL = 60 * 60                # файлы парсера и законченных плейлистов
+PROGRESS_TTL = 7 * 24 * 60 * 60         # плейлист, который пользователь бросил
+MESSAGES_TTL = 2 * 24 * 60 * 60         # старше 48 часов Telegram всё равно не даст удалить
+SNAPSHOTS_TTL = 90 * 24 * 60 * 60
+SETTINGS_TTL = 90 * 24 * 60 * 60        # /paged пользователя, который давно не присылал ссылок
+
+# Постраничный режим (/paged): сколько строк @song в одном сообщении
+PAGE_SIZE_DEFAULT = 10
+PAGE_SIZE_MAX = 30
 
 
 # ----------------- SQLite для прогресса -----------------
@@ -33,16 +42,37 @@ def init_db():
             user_id INTEGER PRIMARY KEY,
             current_index INTEGER DEFAULT 0,
             total_tracks INTEGER DEFAULT 0,
-            json_file TEXT
+            json_file TEXT,
+            updated_at REAL,
+            page_size INTEGER DEFAULT 0
         )
     ''')
     c.execute('''
         CREATE TABLE IF NOT EXISTS user_messages (
             user_id INTEGER,
             bot_message_id INTEGER,
+            created_at REAL,
             PRIMARY KEY (user_id, bot_message_id)
         )
     ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            page_size INTEGER DEFAULT 0,
+            updated_at REAL
+        )
+    ''')
+    # Колонки времени для очистки — добавляем в базы, созданные до их появления
+    for table, column in (('user_progress', 'updated_at'), ('user_messages', 'created_at'),
+                          ('user_settings', 'updated_at')):
+        columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} REAL')
+            # Отсчёт TTL для старых записей — с момента миграции, иначе первая же очистка их удалит
+            c.execute(f'UPDATE {table} SET {column} = ?', (time.time(),))
+    # Размер страницы плейлиста хранится вместе с его прогрессом (0 — по одному треку)
+    if 'page_size' not in [row[1] for row in c.execute('PRAGMA table_info(user_progress)')]:
+        c.execute('ALTER TABLE user_progress ADD COLUMN page_size INTEGER DEFAULT 0')
     conn.commit()
     conn.close()
 
@@ -50,19 +80,30 @@ def init_db():
 def get_progress(user_id):
     conn = sqlite3.connect('bot_progress.db')
     c = conn.cursor()
-    c.execute('SELECT current_index, total_tracks, json_file FROM user_progress WHERE user_id = ?', (user_id,))
+    c.execute('SELECT current_index, total_tracks, json_file, COALESCE(page_size, 0) FROM user_progress '
+              'WHERE user_id = ?', (user_id,))
     row = c.fetchone()
     conn.close()
     return row
 
 
-def update_progress(user_id, index, total, json_file):
+def update_progress(user_id, index, total, json_file, page_size=0):
     conn = sqlite3.connect('bot_progress.db')
     c = conn.cursor()
     c.execute('''
-        INSERT OR REPLACE INTO user_progress (user_id, current_index, total_tracks, json_file)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, index, total, json_file))
+        INSERT OR REPLACE INTO user_progress (user_id, current_index, total_tracks, json_file, updated_at, page_size)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, index, total, json_file, time.time(), page_size))
+    conn.commit()
+    conn.close()
+
+
+def advance_progress(user_id, index):
+    """Сдвигает только текущий индекс: total_tracks во время парсинга пишет цикл пачек"""
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('UPDATE user_progress SET current_index = ?, updated_at = ? WHERE user_id = ?',
+              (index, time.time(), user_id))
     conn.commit()
     conn.close()
 
@@ -76,10 +117,37 @@ def reset_progress(user_id):
     conn.close()
 
 
+def get_page_size(user_id):
+    """
+    Выбранный через /paged размер страницы для следующих плейлистов; 0 — треки по одному.
+    Режим уже начатого плейлиста хранится в его прогрессе (get_progress).
+    """
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('SELECT page_size FROM user_settings WHERE user_id = ?', (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def set_page_size(user_id, page_size):
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    if page_size:
+        c.execute('INSERT OR REPLACE INTO user_settings (user_id, page_size, updated_at) VALUES (?, ?, ?)',
+                  (user_id, page_size, time.time()))
+    else:
+        # 0 — режим по умолчанию, хранить его незачем
+        c.execute('DELETE FROM user_settings WHERE user_id = ?', (user_id,))
+    conn.commit()
+    conn.close()
+
+
 def save_bot_message(user_id, message_id):
     conn = sqlite3.connect('bot_progress.db')
     c = conn.cursor()
-    c.execute('INSERT INTO user_messages (user_id, bot_message_id) VALUES (?, ?)', (user_id, message_id))
+    c.execute('INSERT INTO user_messages (user_id, bot_message_id, created_at) VALUES (?, ?, ?)',
+              (user_id, message_id, time.time()))
     conn.commit()
     conn.close()
 
@@ -101,12 +169,77 @@ def clear_bot_messages(user_id):
     conn.close()
 
 
+# ----------------- Очистка -----------------
+def sweep_abandoned_progress():
+    """Удаляет прогресс и файл плейлиста, если пользователь не двигался дольше PROGRESS_TTL"""
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('SELECT user_id, json_file FROM user_progress WHERE updated_at IS NULL OR updated_at < ?',
+              (time.time() - PROGRESS_TTL,))
+    rows = [row for row in c.fetchall() if row[0] not in active_parsers]
+    for user_id, _ in rows:
+        c.execute('DELETE FROM user_progress WHERE user_id = ?', (user_id,))
+        c.execute('DELETE FROM user_messages WHERE user_id = ?', (user_id,))
+    conn.commit()
+    conn.close()
+
+    cleanup_files([path for _, json_file in rows if json_file for path in (json_file, index_path(json_file))])
+    return len(rows)
+
+
+def sweep_old_messages():
+    """Забывает ID сообщений старше MESSAGES_TTL"""
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('DELETE FROM user_messages WHERE created_at IS NULL OR created_at < ?',
+              (time.time() - MESSAGES_TTL,))
+    removed = c.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def sweep_old_settings():
+    """Забывает /paged пользователей, которые не присылали ссылок дольше SETTINGS_TTL"""
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('DELETE FROM user_settings WHERE updated_at IS NULL OR updated_at < ?',
+              (time.time() - SETTINGS_TTL,))
+    removed = c.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def sweep_temp_files():
+    """Файлы парсера и плейлистов, на которые больше не ссылается прогресс"""
+    conn = sqlite3.connect('bot_progress.db')
+    c = conn.cursor()
+    c.execute('SELECT json_file FROM user_progress')
+    in_use = [path for row in c.fetchall() if row[0] for path in (row[0], index_path(row[0]))]
+    conn.close()
+
+    return remove_stale_files(["playlist_tracks_*", "playlist_stream_*"], TEMP_FILES_TTL, keep=in_use)
+
+
+janitor = Janitor(interval=JANITOR_INTERVAL)
+janitor.register("progress", sweep_abandoned_progress)
+janitor.register("messages", sweep_old_messages)
+janitor.register("settings", sweep_old_settings)
+janitor.register("files", sweep_temp_files)
+janitor.register("snapshots", lambda: sweep_snapshots(SNAPSHOTS_TTL))
+janitor.register("playlist_cache", scrape_service.evict_expired)
+
+
 # ----------------- Бот -----------------
 bot = Bot(token=TG_TOKEN)
 dp = Dispatcher()
 
-# Храним активные задачи парсинга
-active_parsers = {}  # теперь это dict[user_id] = asyncio.Task
+# Храним активные задачи парсинга (сам парсинг общий — в scrape_service)
+active_parsers = UserTasks()
+
+# Пользователи, которые дошли до конца уже загруженных треков и ждут следующую пачку
+waiting_for_tracks = set()
 
 
 def escape_md2(text: str) -> str:
@@ -115,24 +248,39 @@ def escape_md2(text: str) -> str:
     return ''.join(['\\' + c if c in escape_chars else c for c in text])
 
 
+def escape_md2_code(text: str) -> str:
+    """ Экранирует текст внутри `code` в MarkdownV2: там особые только ` и \\ """
+    return text.replace('\\', '\\\\').replace('`', '\\`')
+
+
+def cleanup_files(filepaths: list):
+    """Удаляет временные файлы парсера"""
+    for filepath in filepaths:
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except OSError:
+            pass
+
+
 async def send_track(user_id: int, chat_id: int, index: int):
     """Отправляет трек по индексу и сохраняет ID сообщения"""
     progress = get_progress(user_id)
     if not progress:
         return None
 
-    current_index, total_tracks, json_file = progress
+    current_index, total_tracks, json_file, _ = progress
 
     if index >= total_tracks:
         await bot.send_message(chat_id, "🎉 Плейлист окончен! Все треки отправлены.")
         reset_progress(user_id)
         return None
 
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    track = data["tracks"][index]
-    text = f"Трек {index + 1} из {total_tracks}\n\n`@song {track}`"
+    # Читаем файл построчно до нужного трека — весь плейлист в память не грузим
+    track = TrackFile(json_file).get(index)
+    if track is None:
+        return None
+    text = f"Трек {index + 1} из {total_tracks}\n\n`@song {escape_md2_code(format_track(track))}`"
 
     # Отправляем сообщение
     message = await bot.send_message(chat_id, text, parse_mode="MarkdownV2")
@@ -140,8 +288,8 @@ async def send_track(user_id: int, chat_id: int, index: int):
     # Сохраняем ID сообщения бота
     save_bot_message(user_id, message.message_id)
 
-    # Обновляем прогресс
-    update_progress(user_id, index + 1, total_tracks, json_file)
+    # Обновляем прогресс (total_tracks мог вырасти, пока сообщение отправлялось)
+    advance_progress(user_id, index + 1)
 
     return message.message_id
 
@@ -165,6 +313,73 @@ async def delete_previous_bot_messages(user_id: int, chat_id: int):
         clear_bot_messages(user_id)
 
 
+def get_page_keyboard(has_prev: bool, page_size: int) -> types.InlineKeyboardMarkup:
+    # Размер страницы в самих кнопках — листание работает и после перезапуска бота
+    builder = InlineKeyboardBuilder()
+    if has_prev:
+        builder.button(text="◀️ Назад", callback_data=f"page_prev:{page_size}")
+    builder.button(text="Дальше ▶️", callback_data=f"page_next:{page_size}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+async def send_page(user_id: int, chat_id: int, start: int, page_size: int, message_id: int = None):
+    """
+    Страница треков начиная с start одним сообщением. С message_id — правит
+    это сообщение на месте. Прогресс сдвигается сразу на конец страницы.
+    """
+    progress = get_progress(user_id)
+    if not progress:
+        return None
+
+    current_index, total_tracks, json_file, _ = progress
+
+    tracks = TrackFile(json_file).get_range(start, start + page_size)
+    if not tracks:
+        return None
+    end = start + len(tracks)
+
+    # Одно непроэкранированное название сломало бы разметку всей страницы
+    lines = "\n".join(f"`@song {escape_md2_code(format_track(track))}`" for track in tracks)
+    text = f"Треки {start + 1}–{end} из {total_tracks}\n\n{lines}"
+    keyboard = get_page_keyboard(start > 0, page_size)
+
+    if message_id:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                        parse_mode="MarkdownV2", reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                # Сообщение удалено, не редактируется или не разобралась разметка —
+                # страницу пользователь не увидел, прогресс не двигаем
+                print(f"[User {user_id}] Не удалось показать страницу: {e}")
+                return None
+    else:
+        message = await bot.send_message(chat_id, text, parse_mode="MarkdownV2", reply_markup=keyboard)
+        save_bot_message(user_id, message.message_id)
+        message_id = message.message_id
+
+    if end >= total_tracks and user_id not in active_parsers:
+        # Последняя страница законченного плейлиста — как send_track на последнем треке
+        reset_progress(user_id)
+        return message_id
+
+    # total_tracks мог вырасти, пока страница отправлялась — двигаем только индекс
+    advance_progress(user_id, end)
+    return message_id
+
+
+def last_page_shown(user_id: int) -> bool:
+    """Показана ли уже страница с последним загруженным треком"""
+    progress = get_progress(user_id)
+    return bool(progress) and progress[0] >= progress[1]
+
+
+def next_page_start(current_index: int, page_size: int) -> int:
+    """Начало следующей страницы; если текущая неполная — её же (туда дописались треки)"""
+    return current_index - current_index % page_size
+
+
 @dp.message(CommandStart())
 async def start(message: types.Message):
     await message.answer(
@@ -177,61 +392,215 @@ async def start(message: types.Message):
         "2. Ты нажимаешь на этот текст\n"
         "3. Вставляешь этот текст в чат\n"
         "4. Выбираешь трек из выпадающего списка\n"
-        "5. Я вижу это и автоматически отправляю следующий трек!\n"
+        "5. Я вижу это и автоматически отправляю следующий трек!\n\n"
+        "🆕 Если плейлист уже присылал раньше — отправь /new <ссылка>,\n"
+        "и я пришлю только треки, добавленные с прошлого раза.\n\n"
+        f"📄 /paged — постраничный режим: по {PAGE_SIZE_DEFAULT} треков в сообщении,\n"
+        "листать кнопками. /paged <число> — свой размер страницы, повторный /paged — выключить.\n"
         "Внимание!. Не все треки могут быть в базе бота @song!"
     )
 
 
+@dp.message(Command("new"))
+async def handle_new_tracks(message: types.Message, command: CommandObject):
+    """Режим «продолжить с новыми треками»: присылаем только то, чего не было в прошлый раз"""
+    url = (command.args or "").strip()
+    if not YANDEX_LINK_PATTERN.match(url):
+        await message.answer("Пришли команду в виде: /new <ссылка на плейлист Яндекс Музыки>")
+        return
+
+    await start_playlist(message, url, only_new=True)
+
+
+@dp.message(Command("paged"))
+async def handle_paged(message: types.Message, command: CommandObject):
+    """Постраничный режим: несколько строк @song в одном сообщении вместо трека на сообщение"""
+    user_id = message.from_user.id
+    arg = (command.args or "").strip()
+
+    if arg:
+        if not arg.isdigit():
+            await message.answer("Пришли команду в виде: /paged <сколько треков на странице> (0 — выключить)")
+            return
+        page_size = min(int(arg), PAGE_SIZE_MAX)
+    else:
+        # Без числа — переключаем режим
+        page_size = 0 if get_page_size(user_id) else PAGE_SIZE_DEFAULT
+
+    set_page_size(user_id, page_size)
+    if page_size:
+        await message.answer(
+            f"📄 Постраничный режим: по {page_size} треков в сообщении.\n"
+            "Используй '@song' на строках страницы, а ▶️ — следующая страница.\n"
+            "Действует со следующего плейлиста."
+        )
+    else:
+        await message.answer("🎵 Снова присылаю треки по одному. Действует со следующего плейлиста.")
+
+
+@dp.callback_query(F.data.startswith("page_"))
+async def handle_page_navigation(callback: types.CallbackQuery):
+    """Листание страниц: то же сообщение правится на месте"""
+    user_id = callback.from_user.id
+    chat_id = callback.message.chat.id
+    action, _, size = callback.data.partition(":")
+    page_size = int(size) if size.isdigit() else 0
+
+    progress = get_progress(user_id)
+    if not progress or not page_size:
+        await callback.answer("Нет активного плейлиста — пришли ссылку заново.")
+        return
+
+    current_index, total_tracks, _, _ = progress
+
+    if action == "page_prev":
+        # current_index — конец показанной страницы
+        shown_start = (current_index - 1) // page_size * page_size if current_index else 0
+        start = max(0, shown_start - page_size)
+    else:
+        start = next_page_start(current_index, page_size)
+        if current_index >= total_tracks:
+            if user_id in active_parsers:
+                waiting_for_tracks.add(user_id)
+                await callback.answer("⏳ Следующие треки ещё загружаются, покажу сразу как появятся.")
+            else:
+                await callback.answer("🎉 Это последняя страница.")
+                reset_progress(user_id)
+            return
+
+    await callback.answer()
+    await send_page(user_id, chat_id, start, page_size, message_id=callback.message.message_id)
+
+
 @dp.message(F.text.regexp(YANDEX_LINK_PATTERN))
 async def handle_link(message: types.Message):
-    url = message.text.strip()
+    await start_playlist(message, message.text.strip())
+
+
+async def start_playlist(message: types.Message, url: str, only_new: bool = False):
     user_id = message.from_user.id
     chat_id = message.chat.id
 
-    if user_id in active_parsers:
-        active_parsers[user_id].cancel()  # Отменяем старую задачу
+    if active_parsers.cancel(user_id):  # Отменяем старую задачу
         await message.answer("⏳ Предыдущий парсинг отменён. Запускаю новый...")
 
-    await message.answer("🔄 Начинаю парсинг плейлиста...\nЭто может занять 1–5 минут.")
+    # Если этот плейлист уже парсится (в том числе для другого бота) или есть в кэше —
+    # подключаемся к готовому заданию вместо нового парсинга
+    job = scrape_service.get_job(url)
+
+    # Треки прошлой выгрузки — в режиме only_new их пропускаем
+    known_ids = None
+    if only_new:
+        baseline = job.baseline_snapshot()
+        if baseline:
+            known_ids = {track["track_id"] for track in load_snapshot(baseline)}
+        else:
+            await message.answer("ℹ️ Этот плейлист ещё не выгружался — пришлю все треки.")
+
+    await message.answer("🔄 Начинаю парсинг плейлиста...\nПервый трек пришлю через несколько секунд.")
+
+    # Режим выдачи фиксируем на весь плейлист; используемый выбор /paged продлеваем
+    page_size = get_page_size(user_id)
+    if page_size:
+        set_page_size(user_id, page_size)
 
     async def parse_and_start():
+        sink = None
         try:
             # Очищаем предыдущие сообщения
             await delete_previous_bot_messages(user_id, chat_id)
 
-            await asyncio.to_thread(Startparser, url, user_id)
-
-            json_file = f"playlist_tracks_{user_id}.json"
-            if os.path.exists(json_file):
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                total = len(data["tracks"])
-
-                # Сбрасываем прогресс и начинаем с первого трека
-                update_progress(user_id, 0, total, json_file)
-
-                # Отправляем первый трек
-                await send_track(user_id, chat_id, 0)
-
-                await bot.send_message(
-                    chat_id,
-                    "✅ Плейлист готов!\n\n"
-                    "🎵 Теперь используй функцию '@song' (другого бота) на тексте выше,\n"
-                    "чтобы получить аудиофайл. Как только я увижу аудио-сообщение,\n"
-                    "я автоматически отправлю следующий трек!\n\n"
-                    "❌ Удалять предыдущие сообщения не нужно — я сделаю это автоматически."
-                )
+            # Треки для пользователя дописываем в JSONL, в памяти держим только счётчики;
+            # индекс смещений нужен send_track/send_page, чтобы не перечитывать файл с начала
+            json_file = f"playlist_stream_{user_id}.jsonl"
+            sink = JsonlTrackSink(json_file, index=True)
+            found_count = 0  # весь плейлист, включая уже известные треки
+            unmatched = 0    # треки без ID, которые не с чем сравнить
+
+            # Задание отдаёт сначала уже найденные треки, затем новые пачками по мере парсинга;
+            # ошибка парсера поднимается здесь же
+            async for new_tracks in job.batches():
+                found_count += len(new_tracks)
+                if known_ids is not None:
+                    # ID по номеру строки после вставки выше — уже другой трек: как и diff_tracks,
+                    # такие треки не сравниваем и новыми не считаем
+                    unmatched += sum(1 for track in new_tracks if is_positional_id(track["track_id"]))
+                    new_tracks = [track for track in new_tracks
+                                  if track["track_id"] not in known_ids and not is_positional_id(track["track_id"])]
+                if not new_tracks:
+                    continue
+
+                first_batch = sink.count == 0
+                sink.write(new_tracks)
+
+                progress = get_progress(user_id)
+                current_index = progress[0] if progress and not first_batch else 0
+                update_progress(user_id, current_index, sink.count, json_file, page_size)
+
+                if first_batch and page_size:
+                    # Первая страница сразу; дальше пользователь листает сам
+                    await send_page(user_id, chat_id, 0, page_size)
+                    await bot.send_message(
+                        chat_id,
+                        "✅ Первые треки готовы, остальные догружаются!\n\n"
+                        "🎵 Используй '@song' на строках выше, а ▶️ — следующая страница."
+                    )
+                elif first_batch:
+                    # Отправляем первый трек, не дожидаясь конца парсинга
+                    await send_track(user_id, chat_id, 0)
+
+                    await bot.send_message(
+                        chat_id,
+                        "✅ Первые треки готовы, остальные догружаются!\n\n"
+                        "🎵 Теперь используй функцию '@song' (другого бота) на тексте выше,\n"
+                        "чтобы получить аудиофайл. Как только я увижу аудио-сообщение,\n"
+                        "я автоматически отправлю следующий трек!\n\n"
+                        "❌ Удалять предыдущие сообщения не нужно — я сделаю это автоматически."
+                    )
+                elif user_id in waiting_for_tracks and page_size:
+                    # Пользователь долистал до конца — правим его страницу на следующую
+                    waiting_for_tracks.discard(user_id)
+                    message_ids = get_bot_messages(user_id)
+                    await send_page(user_id, chat_id, next_page_start(current_index, page_size), page_size,
+                                    message_id=message_ids[0] if message_ids else None)
+                elif user_id in waiting_for_tracks:
+                    # Пользователь уже дошёл до конца загруженной части — шлём следующий
+                    waiting_for_tracks.discard(user_id)
+                    await delete_previous_bot_messages(user_id, chat_id)
+                    await send_track(user_id, chat_id, current_index)
+
+            # Снимок плейлиста сохраняет само задание
+            sink.close()
+
+            if unmatched:
+                await message.answer(f"ℹ️ Треков без ID: {unmatched} — сравнить их с прошлой выгрузкой "
+                                     "нельзя, в новые они не попали.")
+
+            if not found_count:
+                await message.answer("❌ Треки не найдены.")
+            elif not sink.count:
+                await message.answer("✅ Новых треков с прошлой выгрузки нет.")
+            elif page_size and (user_id in waiting_for_tracks or last_page_shown(user_id)):
+                waiting_for_tracks.discard(user_id)
+                await bot.send_message(chat_id, "🎉 Плейлист окончен! Это была последняя страница.")
+                reset_progress(user_id)
+            elif user_id in waiting_for_tracks:
+                waiting_for_tracks.discard(user_id)
+                await bot.send_message(chat_id, "🎉 Плейлист окончен! Все треки отправлены.")
+                reset_progress(user_id)
+            elif only_new:
+                await bot.send_message(chat_id, f"📥 Плейлист загружен полностью: {sink.count} новых треков.")
             else:
-                await message.answer("❌ Файл с треками не создан.")
+                await bot.send_message(chat_id, f"📥 Плейлист загружен полностью: {sink.count} треков.")
         except Exception as e:
             await message.answer(f"❌ Ошибка парсинга: {e}")
         finally:
-            # Удаляем задачу из активных
-            if user_id in active_parsers:
-                del active_parsers[user_id]
+            # При отмене задание само остановит парсер, если больше никто его не ждёт
+            if sink:
+                sink.close()
+            waiting_for_tracks.discard(user_id)
 
-    task = asyncio.create_task(parse_and_start())
-    active_parsers[user_id] = task
+    active_parsers.start(user_id, parse_and_start())
 
 
 @dp.message(F.audio | F.voice)
@@ -247,9 +616,19 @@ async def handle_audio_reply(message: types.Message):
         # Или пользователь просто отправляет аудио вне контекста плейлиста
         return
 
-    current_index, total_tracks, json_file = progress
+    current_index, total_tracks, json_file, page_size = progress
+
+    # В постраничном режиме аудио не двигает прогресс — страницы листаются кнопками
+    if page_size:
+        return
 
     # Проверяем, не закончился ли плейлист
+    if current_index >= total_tracks and user_id in active_parsers:
+        # Парсинг ещё идёт — следующий трек пришлём, как только он появится
+        waiting_for_tracks.add(user_id)
+        await message.answer("⏳ Следующие треки ещё загружаются, пришлю сразу как появятся.")
+        return
+
     if current_index >= total_tracks:
         await message.answer("🎉 Плейлист окончен! Все треки отправлены.")
         reset_progress(user_id)
@@ -281,10 +660,23 @@ async def other(message: types.Message):
 
 
 # ----------------- Запуск -----------------
-async def main():
+async def on_startup():
     init_db()
+    janitor.start()
+
+
+async def on_shutdown():
+    janitor.stop()
+    active_parsers.cancel_all()
+
+
+async def main():
+    await on_startup()
     print("Бот запущен!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 
 if __name__ == "__main__":
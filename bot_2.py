@@ -1,27 +1,30 @@
 import asyncio
 import json
 import os
-import re
+import time
 import logging
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import BufferedInputFile
+from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
-from core.driver.get_playlist_tracks import Startparser
+from core.driver.get_playlist_tracks import format_track
+from core.driver.scrape_service import YANDEX_LINK_PATTERN, UserTasks, scrape_service
+from core.driver.snapshots import load_snapshot, diff_tracks
+from core.driver.track_sink import TrackFile
+from core.driver.janitor import Janitor, remove_stale_files, sweep_snapshots
 
 # ----------------- Конфиг -----------------
-TG_TOKEN = "BOT TOKEN"
+TG_TOKEN = os.getenv("BOT2_TOKEN", "BOT TOKEN")
+# Режим парсера (CDP, пул вкладок) и кэш плейлистов — в core/driver/scrape_service.py
 
-# Регулярка для ссылок Яндекс Музыки
-YANDEX_LINK_PATTERN = re.compile(
-    r'https?://music\.yandex\.(ru|com)/playlists/'
-    r'(?:lk\.[a-f0-9\-]+|[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})'
-    r'(?:\?.*)?$',
-    re.IGNORECASE
-)
+# Очистка брошенных данных (секунды)
+JANITOR_INTERVAL = 10 * 60
+USER_FILES_TTL = 60 * 60         # выгрузка, формат которой так и не выбрали
+TEMP_FILES_TTL = 2 * 60 * 60     # файлы без владельца (после падения, отмены и т.п.)
+SNAPSHOTS_TTL = 90 * 24 * 60 * 60
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,25 +34,40 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=TG_TOKEN)
 dp = Dispatcher()
 
-# Храним активные задачи парсинга
-active_parsers = {}  # user_id: task
+# Храним активные задачи парсинга (сам парсинг общий — в scrape_service)
+active_parsers = UserTasks()
 
 
-def create_files_from_json(user_id: int, json_path: str) -> dict:
-    """Создает TXT и JSON файлы из данных парсера"""
-    # Читаем JSON файл
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def write_json_array(f, tracks, indent: str = "  "):
+    """Пишет треки JSON-массивом по одной записи, не собирая список в памяти"""
+    f.write("[")
+    for i, track in enumerate(tracks):
+        f.write(",\n" if i else "\n")
+        f.write(indent + json.dumps(track, ensure_ascii=False))
+    f.write("\n" + indent[:-2] + "]")
 
+
+def create_files_from_tracks(user_id: int, playlist_url: str, tracks: TrackFile,
+                             track_count: int, diff: dict = None) -> dict:
+    """
+    Создает TXT и JSON файлы из JSONL парсера (и файл только с новыми треками, если есть diff).
+    Треки читаются построчно, поэтому память не зависит от размера плейлиста.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     base_filename = f"playlist_{user_id}_{timestamp}"
 
     files = {}
 
-    # 1. Оригинальный JSON (как есть от парсера)
+    # 1. Полный JSON (та же структура, что у парсера)
     json_filename = f"{base_filename}_original.json"
     with open(json_filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("{\n")
+        f.write(f'  "playlist_url": {json.dumps(playlist_url, ensure_ascii=False)},\n')
+        f.write(f'  "total_tracks": {track_count},\n')
+        f.write('  "complite_download": 0,\n')
+        f.write('  "tracks": ')
+        write_json_array(f, tracks, indent="    ")
+        f.write("\n}\n")
     files['json'] = json_filename
 
     # 2. Простой TXT (только названия треков)
@@ -58,23 +76,41 @@ def create_files_from_json(user_id: int, json_path: str) -> dict:
         # Заголовок
         f.write("=" * 50 + "\n")
         f.write(f"Плейлист Яндекс.Музыки\n")
-        f.write(f"Ссылка: {data.get('playlist_url', '')}\n")
-        f.write(f"Всего треков: {len(data.get('tracks', []))}\n")
+        f.write(f"Ссылка: {playlist_url}\n")
+        f.write(f"Всего треков: {track_count}\n")
         f.write(f"Дата экспорта: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n")
         f.write("=" * 50 + "\n\n")
 
-        # Список треков
-        for i, track in enumerate(data.get('tracks', []), 1):
-            f.write(f"{i}. {track}\n")
+        # Список треков в порядке плейлиста
+        for track in tracks:
+            f.write(f"{track['position']}. {format_track(track)}\n")
 
     files['txt'] = txt_filename
 
-    # 3. Упрощенный JSON (только треки)
+    # 3. Упрощенный JSON (только треки: position, track_id, title, artists)
     simple_json_filename = f"{base_filename}_simple.json"
     with open(simple_json_filename, 'w', encoding='utf-8') as f:
-        json.dump(data['tracks'], f, ensure_ascii=False, indent=2)
+        write_json_array(f, tracks)
     files['simple_json'] = simple_json_filename
 
+    # 4. Только новые треки относительно прошлой выгрузки
+    if diff is not None:
+        new_filename = f"{base_filename}_new.txt"
+        with open(new_filename, 'w', encoding='utf-8') as f:
+            f.write("=" * 50 + "\n")
+            f.write("Изменения плейлиста с прошлой выгрузки\n")
+            f.write(f"Ссылка: {playlist_url}\n")
+            f.write(f"Новых: {len(diff['added'])}, удалено: {len(diff['removed'])}, "
+                    f"перемещено: {len(diff['moved'])}\n")
+            if diff['unmatched']:
+                f.write(f"Треков без ID (не сравнивались): {diff['unmatched']}\n")
+            f.write("=" * 50 + "\n\n")
+
+            for track in diff['added']:
+                f.write(f"{track['position']}. {format_track(track)}\n")
+
+        files['new'] = new_filename
+
     return files
 
 
@@ -89,7 +125,35 @@ def cleanup_files(filepaths: list):
             logger.error(f"Ошибка удаления файла {filepath}: {e}")
 
 
-def get_file_keyboard() -> types.InlineKeyboardMarkup:
+def sweep_user_files() -> int:
+    """Удаляет выгрузки из bot.user_files, которые не забирали дольше USER_FILES_TTL"""
+    if not hasattr(bot, 'user_files'):
+        return 0
+
+    cutoff = time.time() - USER_FILES_TTL
+    stale = [
+        user_id for user_id, files in bot.user_files.items()
+        if all(not os.path.exists(path) or os.path.getmtime(path) < cutoff for path in files.values())
+    ]
+    for user_id in stale:
+        cleanup_files(list(bot.user_files.pop(user_id).values()))
+    return len(stale)
+
+
+def sweep_temp_files() -> int:
+    """Файлы парсера и выгрузок, которые не принадлежат ни одной записи bot.user_files"""
+    in_use = [path for files in getattr(bot, 'user_files', {}).values() for path in files.values()]
+    return remove_stale_files(["playlist_tracks_*", "playlist_[0-9]*_*"], TEMP_FILES_TTL, keep=in_use)
+
+
+janitor = Janitor(interval=JANITOR_INTERVAL)
+janitor.register("user_files", sweep_user_files)
+janitor.register("files", sweep_temp_files)
+janitor.register("snapshots", lambda: sweep_snapshots(SNAPSHOTS_TTL))
+janitor.register("playlist_cache", scrape_service.evict_expired)
+
+
+def get_file_keyboard(has_new: bool = False) -> types.InlineKeyboardMarkup:
     """Создает клавиатуру для выбора формата"""
     builder = InlineKeyboardBuilder()
 
@@ -97,8 +161,10 @@ def get_file_keyboard() -> types.InlineKeyboardMarkup:
     builder.button(text="📝 TXT (список)", callback_data="format_txt")
     builder.button(text="🎵 JSON (только треки)", callback_data="format_simple_json")
     builder.button(text="📦 Все файлы", callback_data="format_all")
+    if has_new:
+        builder.button(text="🆕 Только новые треки", callback_data="format_new")
 
-    builder.adjust(2, 2)
+    builder.adjust(2, 2, 1)
     return builder.as_markup()
 
 
@@ -128,7 +194,8 @@ async def help_command(message: types.Message):
         "• 📝 TXT — простой список с номерами\n"
         "• 📄 JSON — полные данные (ссылка, количество треков)\n"
         "• 🎵 JSON — только список треков\n"
-        "• 📦 Все файлы сразу\n\n"
+        "• 📦 Все файлы сразу\n"
+        "• 🆕 Только новые треки — если плейлист уже выгружался раньше\n\n"
         "❌ Чтобы отменить парсинг, используйте /cancel",
         parse_mode="Markdown"
     )
@@ -139,15 +206,8 @@ async def cancel_command(message: types.Message):
     """Обработчик команды /cancel"""
     user_id = message.from_user.id
 
-    if user_id in active_parsers:
-        try:
-            active_parsers[user_id].cancel()
-            await message.answer("✅ Парсинг отменен.")
-        except:
-            pass
-        finally:
-            if user_id in active_parsers:
-                del active_parsers[user_id]
+    if active_parsers.cancel(user_id):
+        await message.answer("✅ Парсинг отменен.")
     else:
         await message.answer("❌ У вас нет активных задач парсинга.")
 
@@ -160,11 +220,12 @@ async def handle_playlist_link(message: types.Message):
     chat_id = message.chat.id
 
     # Проверяем, не парсит ли пользователь уже что-то
-    if user_id in active_parsers:
-        try:
-            active_parsers[user_id].cancel()
-        except:
-            pass
+    active_parsers.cancel(user_id)
+
+    # Тот же плейлист мог уже парситься (в том числе для другого бота) или лежать в кэше
+    job = scrape_service.get_job(url)
+    # Базу для сравнения берём сейчас: после wait() задание уже сохранит свой снимок
+    baseline = job.baseline_snapshot()
 
     # Отправляем сообщение о начале парсинга
     status_msg = await message.answer(
@@ -177,60 +238,58 @@ async def handle_playlist_link(message: types.Message):
     async def parse_playlist():
         """Функция парсинга в фоновом режиме"""
         try:
-            # Запускаем парсер
-            await asyncio.to_thread(Startparser, url, user_id)
-
-            # Проверяем созданные файлы
-            json_file = f"playlist_tracks_{user_id}.json"
+            # Ждём общее задание: парсер пишет треки в его JSONL по мере сбора
+            await job.wait()
 
-            if not os.path.exists(json_file):
+            if not job.count or not os.path.exists(job.path):
                 await message.answer("❌ Не удалось создать файл с треками.")
                 return
 
-            # Читаем данные для отображения статистики
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            tracks = TrackFile(job.path)
+            track_count = job.count
 
-            track_count = len(data.get('tracks', []))
+            # Сравниваем с прошлой выгрузкой этого плейлиста (новый снимок сохранило задание)
+            diff = None
+            if baseline:
+                diff = diff_tracks(load_snapshot(baseline), tracks)
 
             # Создаем файлы для отправки
-            files = create_files_from_json(user_id, json_file)
+            files = create_files_from_tracks(user_id, url, tracks, track_count, diff=diff)
 
             # Сохраняем пути к файлам
             if not hasattr(bot, 'user_files'):
                 bot.user_files = {}
             bot.user_files[user_id] = files
 
-            # Удаляем временный файл парсера
-            try:
-                os.remove(json_file)
-            except:
-                pass
-
             # Отправляем сообщение со статистикой
             stats_text = (
                 f"✅ *Плейлист успешно обработан!*\n\n"
                 f"📊 *Статистика:*\n"
                 f"• Треков найдено: {track_count}\n"
-                f"• Ссылка: {data.get('playlist_url', url)}\n\n"
-                f"📁 *Выберите формат файла:*"
+                f"• Ссылка: {url}\n\n"
             )
+            if diff is not None:
+                stats_text += (
+                    f"🆕 *С прошлой выгрузки:*\n"
+                    f"• Новых: {len(diff['added'])}\n"
+                    f"• Удалено: {len(diff['removed'])}\n"
+                    f"• Перемещено: {len(diff['moved'])}\n\n"
+                )
+                if diff['unmatched']:
+                    # Такие ID — номера строк, сравнение по ним показало бы старые треки новыми
+                    stats_text += f"ℹ️ Треков без ID не сравнивалось: {diff['unmatched']}\n\n"
+            stats_text += "📁 *Выберите формат файла:*"
 
-            await message.answer(stats_text, parse_mode="Markdown", reply_markup=get_file_keyboard())
+            await message.answer(stats_text, parse_mode="Markdown", reply_markup=get_file_keyboard(diff is not None))
 
         except asyncio.CancelledError:
             await message.answer("❌ Парсинг отменен пользователем.")
         except Exception as e:
             logger.error(f"Ошибка парсинга: {e}", exc_info=True)
             await message.answer(f"❌ Ошибка при парсинге: {str(e)}")
-        finally:
-            # Удаляем задачу из активных
-            if user_id in active_parsers:
-                del active_parsers[user_id]
 
     # Создаем и запускаем задачу
-    task = asyncio.create_task(parse_playlist())
-    active_parsers[user_id] = task
+    active_parsers.start(user_id, parse_playlist())
 
 
 @dp.callback_query(F.data.startswith("format_"))
@@ -265,12 +324,8 @@ async def handle_format_selection(callback: types.CallbackQuery):
             continue
 
         try:
-            # Читаем файл
-            with open(filepath, 'rb') as f:
-                file_data = f.read()
-
             # Проверяем размер файла (лимит Telegram: 50MB)
-            file_size = len(file_data)
+            file_size = os.path.getsize(filepath)
             if file_size > 50 * 1024 * 1024:
                 await callback.message.answer(
                     f"❌ Файл слишком большой ({file_size / 1024 / 1024:.1f} MB). "
@@ -282,15 +337,16 @@ async def handle_format_selection(callback: types.CallbackQuery):
             format_names = {
                 'json': 'JSON (полный)',
                 'txt': 'TXT (список)',
-                'simple_json': 'JSON (только треки)'
+                'simple_json': 'JSON (только треки)',
+                'new': 'TXT (только новые треки)'
             }
             file_key = [k for k, v in files.items() if v == filepath][0]
             format_name = format_names.get(file_key, file_key)
 
-            # Отправляем файл
+            # Отправляем файл (aiogram читает его с диска по частям)
             filename = os.path.basename(filepath)
             await callback.message.answer_document(
-                document=BufferedInputFile(file_data, filename=filename),
+                document=FSInputFile(filepath, filename=filename),
                 caption=f"📁 Формат: {format_name}"
             )
 
@@ -330,26 +386,33 @@ async def handle_other_content(message: types.Message):
     await message.answer("Пожалуйста, отправьте ссылку на плейлист Яндекс.Музыки.")
 
 
+async def on_startup():
+    janitor.start()
+
+
+async def on_shutdown():
+    janitor.stop()
+
+    # Отменяем все активные задачи при завершении
+    active_parsers.cancel_all()
+
+    # Очищаем временные файлы
+    if hasattr(bot, 'user_files'):
+        for files in bot.user_files.values():
+            cleanup_files(list(files.values()))
+
+
 async def main():
     """Основная функция запуска бота"""
     logger.info("Запуск бота для экспорта плейлистов...")
 
     try:
+        await on_startup()
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
-        # Отменяем все активные задачи при завершении
-        for user_id, task in list(active_parsers.items()):
-            try:
-                task.cancel()
-            except:
-                pass
-
-        # Очищаем временные файлы
-        if hasattr(bot, 'user_files'):
-            for files in bot.user_files.values():
-                cleanup_files(list(files.values()))
+        await on_shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+# batch_scrape.py
+"""
+Пакетный парсинг плейлистов в JSONL (прогрев кэшей, ночные перепарсы).
+
+Примеры:
+    python -m core.driver.batch_scrape playlists.txt -o result.jsonl --workers 4
+    cat playlists.txt | python -m core.driver.batch_scrape - -o result.jsonl --resume
+    python -m core.driver.batch_scrape playlists.txt --workers 8 --tabs-per-browser 4
+
+Каждая строка вывода — один JSON-объект на плейлист:
+    {"playlist_url": ..., "status": "ok", "attempts": ..., "elapsed": ...,
+     "total_tracks": ..., "tracks": [...]}
+При неудаче вместо треков пишется "status": "error" и текст ошибки в "error".
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.driver.chrome_chromedriver_test import MyDriver
+from core.driver.get_playlist_tracks import GetPlaylistTracksClean
+from core.driver.tab_pool import TabPool
+
+
+def read_urls(source: str) -> list:
+    """Читает ссылки из файла или stdin ('-'), пропуская пустые строки, комментарии и дубли"""
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    try:
+        urls = []
+        seen = set()
+        for line in stream:
+            url = line.strip()
+            if not url or url.startswith('#') or url in seen:
+                continue
+            seen.add(url)
+            urls.append(url)
+        return urls
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def load_done_urls(output_path: str) -> set:
+    """Ссылки, которые уже успешно выгружены в output_path (для --resume)"""
+    done = set()
+    try:
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # недописанная строка после падения
+                if row.get("status") == "ok":
+                    done.add(row.get("playlist_url"))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class DriverPool:
+    """
+    Пул браузеров: создаёт не больше size штук, каждый отдаётся одному воркеру за раз.
+    Размер пула равен числу воркеров, поэтому acquire никогда не ждёт чужой браузер.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if not create:
+            return self._free.get()
+
+        try:
+            return MyDriver().get_driver
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, driver, broken: bool = False):
+        if not broken:
+            self._free.put(driver)
+            return
+
+        # Браузер мог упасть — закрываем, следующий acquire создаст новый
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close(self):
+        while not self._free.empty():
+            try:
+                self._free.get_nowait().quit()
+            except Exception:
+                pass
+
+
+def scrape_playlist(pool, url: str, args) -> dict:
+    """Парсит один плейлист с повторами; всегда возвращает строку для JSONL"""
+    started = time.monotonic()
+    error = None
+
+    for attempt in range(1, args.retries + 2):
+        driver = pool.acquire()
+        broken = False
+        try:
+            parser = GetPlaylistTracksClean(
+                id_tg_user=0,
+                playlist_url=url,
+                step_size=args.step_size,
+                pause_after_scroll=args.pause,
+                max_no_new=args.max_no_new,
+                driver=driver,
+                save_files=False,
+                profile=args.profile,
+                profile_cprofile=args.cprofile,
+                trace_dir=args.trace_dir
+            )
+            if parser.tracks:
+                row = {
+                    "playlist_url": url,
+                    "status": "ok",
+                    "attempts": attempt,
+                    "elapsed": round(time.monotonic() - started, 2),
+                    "total_tracks": len(parser.tracks),
+                    "tracks": parser.tracks,
+                }
+                if parser.trace_file:
+                    row["trace_file"] = parser.trace_file
+                return row
+            error = "Треки не найдены"
+        except Exception as e:
+            error = str(e)
+            broken = True
+        finally:
+            pool.release(driver, broken=broken)
+
+    return {
+        "playlist_url": url,
+        "status": "error",
+        "attempts": args.retries + 1,
+        "elapsed": round(time.monotonic() - started, 2),
+        "error": error,
+    }
+
+
+def log(text: str):
+    """Прогресс пишем в stderr, чтобы не мешать выводу парсера"""
+    print(text, file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Пакетный парсинг плейлистов Яндекс.Музыки в JSONL")
+    arg_parser.add_argument("input", help="Файл со ссылками (по одной в строке) или '-' для stdin")
+    arg_parser.add_argument("-o", "--output", default="playlists.jsonl", help="Файл результата JSONL")
+    arg_parser.add_argument("-w", "--workers", type=int, default=2, help="Число параллельных парсингов")
+    arg_parser.add_argument("--tabs-per-browser", type=int, default=1,
+                            help="Парсингов во вкладках одного Chrome (1 — отдельный браузер на воркер)")
+    arg_parser.add_argument("--retries", type=int, default=1, help="Повторов на плейлист при ошибке")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="Пропустить ссылки, уже успешно записанные в output, и дописывать в конец")
+    arg_parser.add_argument("--step-size", type=int, default=900)
+    arg_parser.add_argument("--pause", type=float, default=5.0)
+    arg_parser.add_argument("--max-no-new", type=int, default=2)
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="Писать трассу этапов каждого парсинга (chrome://tracing / Perfetto)")
+    arg_parser.add_argument("--cprofile", action="store_true",
+                            help="Дополнительно профилировать через cProfile (только с --workers 1)")
+    arg_parser.add_argument("--trace-dir", default="traces", help="Куда складывать трассы")
+    args = arg_parser.parse_args(argv)
+    # cProfile видит только свой поток, а на Python 3.12+ второй одновременный enable()
+    # падает с ValueError — и хороший плейлист записывается в ошибки
+    if args.cprofile and args.workers > 1:
+        arg_parser.error("--cprofile работает только с --workers 1")
+
+    urls = read_urls(args.input)
+    done = load_done_urls(args.output) if args.resume else set()
+    pending = [url for url in urls if url not in done]
+    log(f"Ссылок: {len(urls)}, уже готово: {len(urls) - len(pending)}, к парсингу: {len(pending)}")
+
+    workers = max(1, args.workers)
+    if args.tabs_per_browser > 1:
+        pool = TabPool(workers, args.tabs_per_browser)
+    else:
+        pool = DriverPool(workers)
+    started = time.monotonic()
+    ok = failed = total_tracks = 0
+
+    try:
+        with open(args.output, 'a' if args.resume else 'w', encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = [executor.submit(scrape_playlist, pool, url, args) for url in pending]
+
+            for finished, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+
+                if row["status"] == "ok":
+                    ok += 1
+                    total_tracks += row["total_tracks"]
+                    log(f"[{finished}/{len(pending)}] ✅ {row['playlist_url']} — "
+                        f"{row['total_tracks']} треков за {row['elapsed']}s")
+                else:
+                    failed += 1
+                    log(f"[{finished}/{len(pending)}] ❌ {row['playlist_url']} — {row['error']}")
+    finally:
+        pool.close()
+
+    elapsed = time.monotonic() - started
+    log("\n" + "=" * 50)
+    log(f"Готово: {ok}, ошибок: {failed}, пропущено: {len(urls) - len(pending)}")
+    log(f"Время: {elapsed:.1f}s, треков: {total_tracks}")
+    if elapsed > 0:
+        log(f"Скорость: {(ok + failed) / elapsed * 60:.2f} плейлистов/мин, {total_tracks / elapsed:.1f} треков/с")
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
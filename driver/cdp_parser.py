@@ -0,0 +1,406 @@
+# cdp_parser.py
+"""
+Асинхронный парсер: Chrome управляется напрямую по DevTools Protocol (WebSocket)
+из event loop бота, без Selenium и без отдельного потока на каждый парсинг.
+
+Использование такое же, как у Startparser, только с await:
+    await AsyncStartparser(url, user_id, on_tracks=callback)
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import aiohttp
+
+from core.driver.get_playlist_tracks import (
+    JS_REMOVE_SIDEBAR,
+    JS_SCROLL_STEP,
+    TrackCollector,
+    parse_tracks_html,
+)
+
+CHROME_CANDIDATES = [
+    "google-chrome",
+    "google-chrome-stable",
+    "chromium",
+    "chromium-browser",
+    "chrome",
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+]
+
+# Только контейнер со строками треков — он в разы меньше всей страницы
+JS_TRACKS_HTML = """
+(() => {
+    let container = document.querySelector('[data-virtuoso-scroller="true"]');
+    return (container || document.documentElement).outerHTML;
+})()
+"""
+
+
+class CDPError(RuntimeError):
+    pass
+
+
+def find_chrome() -> str:
+    """Путь к Chrome: переменная CHROME_PATH или первый найденный из CHROME_CANDIDATES"""
+    env_path = os.environ.get("CHROME_PATH")
+    if env_path:
+        return env_path
+
+    for candidate in CHROME_CANDIDATES:
+        path = shutil.which(candidate) or (candidate if os.path.exists(candidate) else None)
+        if path:
+            return path
+
+    raise RuntimeError("Chrome не найден. Укажите путь в переменной окружения CHROME_PATH")
+
+
+class CDPBrowser:
+    """Один процесс Chrome и одно WebSocket-соединение с ним, общие для всех вкладок"""
+
+    def __init__(self, chrome_path: Optional[str] = None, headless: bool = True):
+        self.chrome_path = chrome_path
+        self.headless = headless
+
+        self._process = None
+        self._user_data_dir = None
+        self._http = None
+        self._ws = None
+        self._reader = None
+        self._ids = itertools.count(1)
+        self._pending = {}    # id команды -> Future с ответом
+        self._listeners = {}  # (session_id, method) -> список Future
+
+    async def start(self):
+        self._user_data_dir = tempfile.mkdtemp(prefix="cdp_chrome_")
+        args = [
+            self.chrome_path or find_chrome(),
+            f"--user-data-dir={self._user_data_dir}",
+            "--remote-debugging-port=0",
+            "--no-first-run",
+            "--no-default-browser-check",
+            "--disable-dev-shm-usage",
+            "--no-sandbox",
+            "--window-size=1920,1080",
+        ]
+        if self.headless:
+            args.append("--headless=new")
+        args.append("about:blank")
+
+        self._process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+
+        ws_url = await self._wait_devtools_url()
+        self._http = aiohttp.ClientSession()
+        self._ws = await self._http.ws_connect(ws_url, max_msg_size=0)
+        self._reader = asyncio.create_task(self._read_loop())
+        print(f"CDP: браузер запущен ({ws_url})")
+        return self
+
+    async def _wait_devtools_url(self, timeout: float = 30.0) -> str:
+        """Chrome пишет порт и путь WebSocket в DevToolsActivePort после старта"""
+        port_file = os.path.join(self._user_data_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if self._process.returncode is not None:
+                raise RuntimeError(f"Chrome завершился с кодом {self._process.returncode}")
+            try:
+                with open(port_file, 'r', encoding='utf-8') as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    return f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+            except FileNotFoundError:
+                pass
+            await asyncio.sleep(0.1)
+
+        raise RuntimeError("Chrome не открыл DevTools за отведённое время")
+
+    async def _read_loop(self):
+        try:
+            async for msg in self._ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+
+                if "id" in data:
+                    future = self._pending.pop(data["id"], None)
+                    if future and not future.done():
+                        if "error" in data:
+                            future.set_exception(CDPError(data["error"].get("message", str(data["error"]))))
+                        else:
+                            future.set_result(data.get("result", {}))
+                    continue
+
+                key = (data.get("sessionId"), data.get("method"))
+                for future in self._listeners.pop(key, []):
+                    if not future.done():
+                        future.set_result(data.get("params", {}))
+        finally:
+            # Соединение закрыто — будим всех, кто ждёт ответа
+            for future in list(self._pending.values()) + [f for fs in self._listeners.values() for f in fs]:
+                if not future.done():
+                    future.set_exception(CDPError("Соединение с браузером закрыто"))
+            self._pending.clear()
+            self._listeners.clear()
+
+    async def send(self, method: str, params: Optional[dict] = None,
+                   session_id: Optional[str] = None, timeout: float = 30.0) -> dict:
+        message_id = next(self._ids)
+        payload = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            payload["sessionId"] = session_id
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        await self._ws.send_str(json.dumps(payload))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    def expect_event(self, method: str, session_id: Optional[str] = None) -> asyncio.Future:
+        """Future, которое завершится при следующем событии method (подписываться до действия)"""
+        future = asyncio.get_running_loop().create_future()
+        self._listeners.setdefault((session_id, method), []).append(future)
+        return future
+
+    def discard_listener(self, method: str, session_id: Optional[str], future: asyncio.Future):
+        listeners = self._listeners.get((session_id, method), [])
+        if future in listeners:
+            listeners.remove(future)
+
+    async def new_page(self, isolated: bool = True) -> "CDPPage":
+        """Новая вкладка; isolated — в отдельном browser context (свои cookies и кэш)"""
+        context_id = None
+        if isolated:
+            context_id = (await self.send("Target.createBrowserContext"))["browserContextId"]
+
+        params = {"url": "about:blank"}
+        if context_id:
+            params["browserContextId"] = context_id
+        target_id = (await self.send("Target.createTarget", params))["targetId"]
+
+        session_id = (await self.send("Target.attachToTarget", {"targetId": target_id, "flatten": True}))["sessionId"]
+        page = CDPPage(self, target_id, session_id, context_id)
+        await page.send("Page.enable")
+        await page.send("Runtime.enable")
+        return page
+
+    @property
+    def alive(self) -> bool:
+        """Chrome жив и WebSocket к нему открыт"""
+        return (self._ws is not None and not self._ws.closed
+                and self._process is not None and self._process.returncode is None)
+
+    async def close(self):
+        try:
+            if self._ws and not self._ws.closed:
+                await self.send("Browser.close", timeout=5)
+        except Exception:
+            pass
+        if self._ws:
+            await self._ws.close()
+        if self._http:
+            await self._http.close()
+        if self._reader:
+            self._reader.cancel()
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._user_data_dir:
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+
+
+class CDPPage:
+    """Вкладка браузера: навигация, выполнение JS и ожидания — всё через await"""
+
+    def __init__(self, browser: CDPBrowser, target_id: str, session_id: str, context_id: Optional[str]):
+        self.browser = browser
+        self.target_id = target_id
+        self.session_id = session_id
+        self.context_id = context_id
+
+    async def send(self, method: str, params: Optional[dict] = None, timeout: float = 30.0) -> dict:
+        return await self.browser.send(method, params, session_id=self.session_id, timeout=timeout)
+
+    async def navigate(self, url: str, timeout: float = 30.0):
+        loaded = self.browser.expect_event("Page.loadEventFired", self.session_id)
+        try:
+            result = await self.send("Page.navigate", {"url": url})
+            if result.get("errorText"):
+                raise CDPError(f"Не удалось открыть {url}: {result['errorText']}")
+            await asyncio.wait_for(loaded, timeout)
+        finally:
+            self.browser.discard_listener("Page.loadEventFired", self.session_id, loaded)
+
+    async def evaluate(self, expression: str, await_promise: bool = False):
+        result = await self.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True,
+            "awaitPromise": await_promise,
+        })
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CDPError(details.get("exception", {}).get("description") or details.get("text", "JS error"))
+        return result.get("result", {}).get("value")
+
+    async def execute_script(self, body: str):
+        """Аналог Selenium execute_script: body — тело функции с return"""
+        return await self.evaluate(f"(() => {{ {body} }})()")
+
+    async def wait_for(self, expression: str, timeout: float = 20.0, interval: float = 0.25):
+        """Ждёт, пока JS-выражение станет истинным; возвращает его значение"""
+        deadline = time.monotonic() + timeout
+        while True:
+            value = await self.evaluate(expression)
+            if value:
+                return value
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"Не дождались: {expression}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        try:
+            await self.browser.send("Target.closeTarget", {"targetId": self.target_id}, timeout=5)
+            if self.context_id:
+                await self.browser.send("Target.disposeBrowserContext", {"browserContextId": self.context_id}, timeout=5)
+        except Exception:
+            pass
+
+
+_shared_browser: Optional[CDPBrowser] = None
+_shared_browser_lock: Optional[asyncio.Lock] = None
+
+
+async def get_shared_browser() -> CDPBrowser:
+    """Один Chrome на процесс; каждый парсинг открывает в нём свою вкладку"""
+    global _shared_browser, _shared_browser_lock
+    if _shared_browser_lock is None:
+        _shared_browser_lock = asyncio.Lock()
+    async with _shared_browser_lock:
+        if _shared_browser is not None and not _shared_browser.alive:
+            # Chrome упал или соединение оборвалось — поднимаем новый
+            print("CDP: общий браузер недоступен, перезапускаю")
+            await _shared_browser.close()
+            _shared_browser = None
+        if _shared_browser is None:
+            _shared_browser = await CDPBrowser().start()
+        return _shared_browser
+
+
+@dataclass
+class AsyncGetPlaylistTracks(TrackCollector):
+    id_tg_user: int
+    playlist_url: str
+    step_size: int = 900
+    pause_after_scroll: float = 5.0
+    max_no_new: int = 2
+    on_tracks: Optional[Callable[[list], None]] = None
+    browser: Optional[CDPBrowser] = None
+    save_files: bool = True
+    stream: bool = False
+    # База имён файлов результата; по умолчанию playlist_tracks_{id_tg_user}
+    file_prefix: Optional[str] = None
+    # Сколько ждать появления списка треков после загрузки страницы
+    load_timeout: float = 20.0
+
+    tracks: list = field(init=False, default_factory=list)
+    total_tracks: int = field(init=False, default=0)
+    tracks_file_txt: str = field(init=False)
+    tracks_file_json: str = field(init=False)
+    tracks_file_jsonl: str = field(init=False)
+
+    def __post_init__(self):
+        prefix = self.file_prefix or f"playlist_tracks_{self.id_tg_user}"
+        self.tracks_file_txt = f"{prefix}.txt"
+        self.tracks_file_json = f"{prefix}.json"
+        self.tracks_file_jsonl = f"{prefix}.jsonl"
+
+    async def run(self) -> list:
+        browser = self.browser or await get_shared_browser()
+        page = await browser.new_page()
+        self._open_sink()
+        try:
+            print(f"[User {self.id_tg_user}] CDP: открываю плейлист: {self.playlist_url}")
+            await page.navigate(self.playlist_url)
+            # Вместо фиксированных 8 секунд ждём появления списка треков
+            await page.wait_for('!!document.querySelector(\'[data-virtuoso-scroller="true"]\')',
+                                timeout=self.load_timeout)
+
+            await page.execute_script(JS_REMOVE_SIDEBAR)
+
+            all_tracks = {}
+            self._emit_new_tracks(await self._parse_tracks(page), all_tracks)
+            print(f"Найдено изначально: {len(all_tracks)} треков")
+
+            no_new_tracks_count = 0
+            while no_new_tracks_count < self.max_no_new:
+                result = await page.execute_script(JS_SCROLL_STEP.format(step_size=self.step_size))
+                if result is None:
+                    print("Ошибка: Virtuoso scroller не найден.")
+                    break
+
+                await asyncio.sleep(self.pause_after_scroll)
+
+                if self._emit_new_tracks(await self._parse_tracks(page), all_tracks) == 0:
+                    no_new_tracks_count += 1
+                else:
+                    no_new_tracks_count = 0
+        finally:
+            self._close_sink()
+            await page.close()
+
+        self._collect_result(all_tracks)
+        print(f"CDP: собрано {self.total_tracks} треков")
+        if self.total_tracks and self.save_files:
+            self._save_tracks()
+        return self.tracks
+
+    async def _parse_tracks(self, page: CDPPage) -> list:
+        html = await page.evaluate(JS_TRACKS_HTML)
+        # BeautifulSoup в потоке — иначе разбор блокирует event loop ботов
+        return await asyncio.to_thread(parse_tracks_html, html)
+
+
+async def AsyncStartparser(playlist_url: str, id_tg_user: int,
+                           on_tracks: Optional[Callable[[list], None]] = None,
+                           browser: Optional[CDPBrowser] = None, stream: bool = False) -> list:
+    """
+    Асинхронный аналог Startparser: те же файлы на выходе, on_tracks вызывается в event loop.
+    """
+    parser = AsyncGetPlaylistTracks(
+        id_tg_user=id_tg_user,
+        playlist_url=playlist_url,
+        pause_after_scroll=5.0,
+        step_size=900,
+        on_tracks=on_tracks,
+        browser=browser,
+        stream=stream
+    )
+    return await parser.run()
+
+
+# ----------------- ТЕСТОВЫЙ ЗАПУСК -----------------
+if __name__ == "__main__":
+    async def _test():
+        browser = await CDPBrowser().start()
+        try:
+            urls = ["https://music.yandex.ru/playlists/05a74673-8b71-4f78-99ec-ee2640e26886"]
+            results = await asyncio.gather(*[
+                AsyncStartparser(url, 123456789 + i, browser=browser) for i, url in enumerate(urls)
+            ])
+            print([len(tracks) for tracks in results])
+        finally:
+            await browser.close()
+
+    asyncio.run(_test())
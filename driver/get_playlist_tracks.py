@@ -1,52 +1,294 @@
 # get_playlist_tracks.py
 
+from contextlib import nullcontext
 from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+import cProfile
+import os
 import time
 import json
 import re
+import threading
 from bs4 import BeautifulSoup
+from selenium.webdriver import Chrome
 from core.driver.chrome_chromedriver_test import MyDriver
+from core.driver.track_sink import JsonlTrackSink, TrackFile
+from core.driver.scrape_trace import JS_NAVIGATION_TIMING, ScrapeTrace
+from core.driver.snapshots import POSITIONAL_ID_PREFIX, playlist_id_from_url
+
+# Общий браузер по умолчанию — создаётся при первом запуске парсера, а не при импорте
+_shared_driver: Optional[Chrome] = None
+_shared_driver_lock = threading.Lock()
+
+
+def get_shared_driver() -> Chrome:
+    global _shared_driver
+    with _shared_driver_lock:
+        if _shared_driver is None:
+            _shared_driver = MyDriver().get_driver
+        return _shared_driver
+
+
+JS_REMOVE_SIDEBAR = """
+let sidebar = document.querySelector('aside[class*="Navbar_root"]');
+if (sidebar) sidebar.remove();
+
+let banner = document.querySelector('section[class*="SideAdvertBanner_root"]');
+if (banner) banner.remove();
+"""
+
+# Тело функции: шаг скролла Virtuoso, возвращает scrollHeight или null
+JS_SCROLL_STEP = """
+let container = document.querySelector('[data-virtuoso-scroller="true"]');
+if (!container) return null;
+
+container.scrollTop += {step_size};
+
+if (container.scrollTop + container.clientHeight + 500 >= container.scrollHeight) {{
+    container.scrollTop = container.scrollHeight;
+}}
+
+return container.scrollHeight;
+"""
+
+TRACK_ID_PATTERN = re.compile(r'/track/(\d+)')
+
+
+def parse_tracks_html(html: str) -> list:
+    """
+    Парсит видимые строки плейлиста в записи {track_id, title, artists, index}.
+    track_id берётся из ссылки Meta_albumLink__ (/album/.../track/<id>),
+    а если его нет — из data-index строки Virtuoso.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    current = []
+    track_links = soup.find_all('a', class_=re.compile(r'Meta_albumLink__', re.I))
+
+    for link in track_links:
+        title_span = link.find('span', class_=re.compile(r'Meta_title__', re.I))
+        if not title_span:
+            continue
+        title = title_span.get_text(strip=True)
+
+        artist_span = link.find_next('span', class_=re.compile(r'Meta_subtitle__|artist', re.I))
+        artists = artist_span.get_text(strip=True, separator=', ') if artist_span else "Unknown Artist"
+
+        row = link.find_parent(attrs={'data-index': True})
+        index = int(row['data-index']) if row and row['data-index'].isdigit() else None
+
+        id_match = TRACK_ID_PATTERN.search(link.get('href', ''))
+        if id_match:
+            track_id = id_match.group(1)
+        elif index is not None:
+            track_id = f"{POSITIONAL_ID_PREFIX}{index}"
+        else:
+            track_id = link.get('href') or f"{title} {artists}"
+
+        current.append({
+            "track_id": track_id,
+            "title": title,
+            "artists": artists,
+            "index": index,
+        })
+
+    return current
+
+
+def format_track(track: dict) -> str:
+    """ Строка для поиска через @song: "название исполнители" без дефисов """
+    # УБИРАЕМ ВСЕ ДЕФИСЫ из названия и артистов
+    clean_title = track["title"].replace('-', '').strip()
+    clean_artists = track["artists"].replace('-', '').strip()
+    return f"{clean_title} {clean_artists}".strip()
+
+
+class TrackCollector:
+    """
+    Общая часть парсеров: накопление треков и сохранение результата.
+    Ожидает атрибуты on_tracks, stream, playlist_url и tracks_file_*.
+
+    В потоковом режиме (stream=True) записи сразу дописываются в tracks_file_jsonl,
+    а в памяти остаются только ID для отсева дублей.
+    """
+
+    _sink: Optional[JsonlTrackSink] = None
+
+    def _open_sink(self):
+        self._sink = JsonlTrackSink(self.tracks_file_jsonl) if self.stream else None
+
+    def _close_sink(self):
+        if self._sink:
+            self._sink.close()
+
+    def _emit_new_tracks(self, current_tracks, all_tracks):
+        """ Добавляет новые треки в all_tracks и отдаёт их в on_tracks в порядке появления """
+        new_tracks = []
+        for track in current_tracks:
+            if track["track_id"] in all_tracks:
+                continue
+
+            index = track.pop("index")
+            # Индекс Virtuoso точнее счётчика, если строка его отдала
+            position = index + 1 if index is not None else len(all_tracks) + 1
+            track = {"position": position, **track}
+
+            all_tracks[track["track_id"]] = None if self._sink else track
+            new_tracks.append(track)
+
+        if new_tracks:
+            if self._sink:
+                self._sink.write(new_tracks)
+            if self.on_tracks:
+                self.on_tracks(new_tracks)
+
+        return len(new_tracks)
+
+    def _collect_result(self, all_tracks):
+        """ Итог парсинга: total_tracks всегда, tracks — только если треки держались в памяти """
+        self.total_tracks = len(all_tracks)
+        self.tracks = [] if self.stream else list(all_tracks.values())
+
+    def iter_result(self):
+        """ Итератор по собранным трекам — из памяти или из JSONL """
+        return TrackFile(self.tracks_file_jsonl) if self.stream else iter(self.tracks)
+
+    def _save_tracks(self):
+        with open(self.tracks_file_txt, 'w', encoding='utf-8') as f:
+            for track in self.iter_result():
+                f.write(f"{track['position']}. {format_track(track)}\n")
+
+        # В потоковом режиме результатом служит сам JSONL
+        if self.stream:
+            return
+
+        json_data = {
+            "playlist_url": self.playlist_url,
+            "total_tracks": len(self.tracks),
+            "complite_download": 0,  # Здесь можно обновлять при отправке треков
+            "tracks": self.tracks
+        }
+        with open(self.tracks_file_json, 'w', encoding='utf-8') as f:
+            json.dump(json_data, f, ensure_ascii=False, indent=2)
 
 
 @dataclass
-class GetPlaylistTracksClean:
+class GetPlaylistTracksClean(TrackCollector):
     id_tg_user: int
     playlist_url: str
     step_size: int = 900
     pause_after_scroll: float = 5.0
     max_no_new: int = 2
-
-    driver = MyDriver().get_driver
+    # Колбэк для постепенной выдачи: вызывается с каждой пачкой новых треков
+    on_tracks: Optional[Callable[[list], None]] = None
+    # Свой драйвер (по одному на воркер или вкладка TabPool); по умолчанию — общий браузер
+    driver: Optional[Chrome] = None
+    # False — ничего не пишем на диск, результат только в self.tracks
+    save_files: bool = True
+    # True — треки пишутся в tracks_file_jsonl по мере сбора и не копятся в памяти
+    stream: bool = False
+    # Профилирование: трасса этапов по шагам в trace_dir (и cProfile, если profile_cprofile)
+    profile: bool = False
+    profile_cprofile: bool = False
+    trace_dir: str = "traces"
+    # База имён файлов результата; по умолчанию playlist_tracks_{id_tg_user}
+    file_prefix: Optional[str] = None
+
+    tracks: list = field(init=False, default_factory=list)
+    total_tracks: int = field(init=False, default=0)
+    trace: Optional[ScrapeTrace] = field(init=False, default=None)
+    trace_file: Optional[str] = field(init=False, default=None)
     # Имена файлов вычисляем динамически после инициализации
     tracks_file_txt: str = field(init=False)
     tracks_file_json: str = field(init=False)
+    tracks_file_jsonl: str = field(init=False)
 
     def __post_init__(self):
         # Теперь id_tg_user доступен — формируем имена файлов
-        self.tracks_file_txt = f"playlist_tracks_{self.id_tg_user}.txt"
-        self.tracks_file_json = f"playlist_tracks_{self.id_tg_user}.json"
+        prefix = self.file_prefix or f"playlist_tracks_{self.id_tg_user}"
+        self.tracks_file_txt = f"{prefix}.txt"
+        self.tracks_file_json = f"{prefix}.json"
+        self.tracks_file_jsonl = f"{prefix}.jsonl"
 
-        self.run()
+        if self.driver is None:
+            self.driver = get_shared_driver()
+
+        if self.profile or self.profile_cprofile:
+            self._run_profiled()
+        else:
+            self.run()
+
+    def _run_profiled(self):
+        """ run() с записью трассы в trace_dir/trace_{плейлист}_{время}.json """
+        os.makedirs(self.trace_dir, exist_ok=True)
+        # Микросекунды и ID плейлиста — параллельные воркеры batch_scrape не затирают трассы друг друга
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        try:
+            name = playlist_id_from_url(self.playlist_url)
+        except ValueError:
+            name = self.id_tg_user
+        self.trace_file = os.path.join(self.trace_dir, f"trace_{name}_{stamp}.json")
+        self.trace = ScrapeTrace(
+            self.playlist_url,
+            id_tg_user=self.id_tg_user,
+            step_size=self.step_size,
+            pause_after_scroll=self.pause_after_scroll,
+            max_no_new=self.max_no_new,
+        )
+
+        profiler = cProfile.Profile() if self.profile_cprofile else None
+        try:
+            if profiler:
+                profiler.enable()
+            self.run()
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self.trace_file[:-len(".json")] + ".prof")
+                self.trace.set_cprofile(profiler)
+            self.trace.save(self.trace_file)
+            print(f"Трасса парсинга сохранена в {self.trace_file}")
+
+    def _span(self, name, **args):
+        """ Замер этапа, если включено профилирование """
+        return self.trace.span(name, **args) if self.trace else nullcontext(args)
 
     def run(self):
         print(f"[User {self.id_tg_user}] Открываю плейлист: {self.playlist_url}")
-        self.driver.get(self.playlist_url)
-        time.sleep(8)
+        with self._span("navigate"):
+            self.driver.get(self.playlist_url)
+        with self._span("initial_sleep"):
+            time.sleep(8)
+
+        if self.trace:
+            self.trace.navigation = json.loads(self.driver.execute_script(JS_NAVIGATION_TIMING))
 
         print("Удаляю боковую панель и баннер...")
-        self._remove_sidebar_and_banner()
+        with self._span("remove_sidebar"):
+            self._remove_sidebar_and_banner()
 
         print("Собираем уже видимые треки (первые, загруженные сразу)...")
-        all_tracks = set(self._parse_tracks_raw())
-        print(f"Найдено изначально: {len(all_tracks)} треков")
-
-        print(f"Запускаю цикл скролл → пауза → парсинг (шаг {self.step_size}px, пауза {self.pause_after_scroll}s)...")
-        tracks = self._scroll_and_parse_progressive(all_tracks)
-
-        if tracks:
-            print(f"\nУспешно собрано {len(tracks)} уникальных треков!")
-            self._save_tracks(tracks)
-            print(f"Сохранено в {self.tracks_file_txt} и {self.tracks_file_json}")
+        all_tracks = {}  # track_id -> запись; dict сохраняет порядок плейлиста
+        self._open_sink()
+        try:
+            new_added = self._emit_new_tracks(self._parse_tracks_raw(), all_tracks)
+            if self.trace:
+                self.trace.add_step(step=0, new_tracks=new_added, total_tracks=len(all_tracks))
+            print(f"Найдено изначально: {len(all_tracks)} треков")
+
+            print(f"Запускаю цикл скролл → пауза → парсинг (шаг {self.step_size}px, пауза {self.pause_after_scroll}s)...")
+            self._scroll_and_parse_progressive(all_tracks)
+        finally:
+            self._close_sink()
+        self._collect_result(all_tracks)
+
+        if self.total_tracks:
+            print(f"\nУспешно собрано {self.total_tracks} уникальных треков!")
+            if self.save_files:
+                self._save_tracks()
+                print(f"Сохранено в {self.tracks_file_txt} и "
+                      f"{self.tracks_file_jsonl if self.stream else self.tracks_file_json}")
         else:
             print("Треки не были собраны.")
 
@@ -54,18 +296,11 @@ class GetPlaylistTracksClean:
         print("Парсинг завершён. Браузер можно закрыть вручную.")
 
     def _remove_sidebar_and_banner(self):
-        js_remove = """
-        let sidebar = document.querySelector('aside[class*="Navbar_root"]');
-        if (sidebar) sidebar.remove();
-
-        let banner = document.querySelector('section[class*="SideAdvertBanner_root"]');
-        if (banner) banner.remove();
-        """
-        self.driver.execute_script(js_remove)
+        self.driver.execute_script(JS_REMOVE_SIDEBAR)
         time.sleep(1)
 
-    def _scroll_and_parse_progressive(self, initial_tracks_set):
-        all_tracks = initial_tracks_set
+    def _scroll_and_parse_progressive(self, initial_tracks):
+        all_tracks = initial_tracks
         no_new_tracks_count = 0
         step_count = 0
 
@@ -73,33 +308,22 @@ class GetPlaylistTracksClean:
             step_count += 1
             print(f"Шаг {step_count}: скроллим на {self.step_size}px...")
 
-            js_scroll_step = f"""
-            let container = document.querySelector('[data-virtuoso-scroller="true"]');
-            if (!container) return null;
-
-            container.scrollTop += {self.step_size};
-
-            if (container.scrollTop + container.clientHeight + 500 >= container.scrollHeight) {{
-                container.scrollTop = container.scrollHeight;
-            }}
-
-            return container.scrollHeight;
-            """
-            result = self.driver.execute_script(js_scroll_step)
+            with self._span("scroll", step=step_count):
+                result = self.driver.execute_script(JS_SCROLL_STEP.format(step_size=self.step_size))
             if result is None:
                 print("Ошибка: Virtuoso scroller не найден.")
                 break
 
             print(f"  Пауза {self.pause_after_scroll} сек на подгрузку...")
-            time.sleep(self.pause_after_scroll)
+            with self._span("wait", step=step_count):
+                time.sleep(self.pause_after_scroll)
 
             current_tracks = self._parse_tracks_raw()
 
-            before = len(all_tracks)
-            for track in current_tracks:
-                all_tracks.add(track)
+            new_added = self._emit_new_tracks(current_tracks, all_tracks)
             after = len(all_tracks)
-            new_added = after - before
+            if self.trace:
+                self.trace.add_step(step=step_count, scroll_height=result, new_tracks=new_added, total_tracks=after)
 
             if new_added == 0:
                 no_new_tracks_count += 1
@@ -109,59 +333,34 @@ class GetPlaylistTracksClean:
                 print(f"  → Добавлено {new_added} новых треков (всего: {after})")
 
         print(f"\nСбор завершён! Всего уникальных треков: {len(all_tracks)}")
-        return sorted(list(all_tracks))
+        return all_tracks
 
     def _parse_tracks_raw(self):
-        """ Парсит текущие видимые треки из HTML, убирает '-' для безопасности """
-        soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-
-        current = []
-        track_links = soup.find_all('a', class_=re.compile(r'Meta_albumLink__', re.I))
-
-        for link in track_links:
-            title_span = link.find('span', class_=re.compile(r'Meta_title__', re.I))
-            if not title_span:
-                continue
-            title = title_span.get_text(strip=True)
-
-            artist_span = link.find_next('span', class_=re.compile(r'Meta_subtitle__|artist', re.I))
-            artists = artist_span.get_text(strip=True, separator=', ') if artist_span else "Unknown Artist"
-
-            # УБИРАЕМ ВСЕ ДЕФИСЫ из названия и артистов
-            clean_title = title.replace('-', '').strip()
-            clean_artists = artists.replace('-', '').strip()
-
-            # Формируем строку без дефиса
-            clean_track = f"{clean_title} {clean_artists}".strip()
-
-            current.append(clean_track)
-
-        return current
-
-    def _save_tracks(self, tracks):
-        with open(self.tracks_file_txt, 'w', encoding='utf-8') as f:
-            for i, track in enumerate(tracks, 1):
-                f.write(f"{i}. {track}\n")
-
-        json_data = {
-            "playlist_url": self.playlist_url,
-            "total_tracks": len(tracks),
-            "complite_download": 0,  # Здесь можно обновлять при отправке треков
-            "tracks": tracks
-        }
-        with open(self.tracks_file_json, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
+        """ Парсит текущие видимые треки из HTML """
+        with self._span("page_source") as span:
+            html = self.driver.page_source
+            if self.trace:
+                span["bytes"] = len(html.encode('utf-8'))
+        with self._span("parse"):
+            return parse_tracks_html(html)
 
 
-def Startparser(playlist_url: str, id_tg_user: int):
+def Startparser(playlist_url: str, id_tg_user: int, on_tracks: Optional[Callable[[list], None]] = None,
+                driver=None, stream: bool = False):
     """
-    Запуск парсера для конкретного пользователя
+    Запуск парсера для конкретного пользователя.
+    on_tracks вызывается из потока парсера с каждой пачкой новых треков.
+    driver — свой браузер или вкладка TabPool; по умолчанию общий браузер.
+    stream — писать треки в playlist_tracks_{id}.jsonl по мере сбора вместо JSON в конце.
     """
     GetPlaylistTracksClean(
         id_tg_user=id_tg_user,
         playlist_url=playlist_url,
         pause_after_scroll=5.0,
-        step_size=900
+        step_size=900,
+        on_tracks=on_tracks,
+        driver=driver,
+        stream=stream
     )
 
 
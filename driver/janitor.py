@@ -0,0 +1,94 @@
+# janitor.py
+"""
+Фоновая очистка: временные файлы, брошенные снимки и состояние пользователей по TTL.
+
+Каждый бот регистрирует свои «уборщики» — функции без аргументов, которые
+возвращают, сколько объектов удалили. Janitor периодически вызывает их
+в отдельном потоке (event loop общий для ботов — не держим его на SQLite
+и файловой системе) и копит счётчики в stats.
+"""
+
+import asyncio
+import glob
+import os
+import time
+from collections import Counter
+from typing import Callable, Iterable, Optional
+
+from core.driver.snapshots import SNAPSHOTS_DIR
+
+
+class Janitor:
+    def __init__(self, interval: float = 600.0):
+        self.interval = interval
+        self.sweepers = {}        # имя -> callable() -> int
+        self.stats = Counter()    # имя -> сколько удалено за всё время
+        self.last_run: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, sweeper: Callable[[], int]):
+        self.sweepers[name] = sweeper
+
+    def sweep(self) -> dict:
+        """Один проход всех уборщиков; возвращает, сколько удалил каждый"""
+        reclaimed = {}
+        for name, sweeper in self.sweepers.items():
+            try:
+                reclaimed[name] = sweeper()
+            except Exception as e:
+                print(f"Janitor: ошибка уборщика {name}: {e}")
+                continue
+            self.stats[name] += reclaimed[name]
+
+        self.last_run = time.time()
+        if any(reclaimed.values()):
+            print("Janitor: удалено " + ", ".join(f"{name}={count}" for name, count in reclaimed.items() if count))
+        return reclaimed
+
+    async def run_forever(self):
+        while True:
+            await asyncio.to_thread(self.sweep)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+        return self._task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+
+def remove_stale_files(patterns: Iterable[str], ttl: float, keep: Iterable[str] = ()) -> int:
+    """Удаляет файлы по glob-шаблонам, не менявшиеся дольше ttl секунд (кроме keep)"""
+    keep = {os.path.abspath(path) for path in keep if path}
+    cutoff = time.time() - ttl
+    removed = 0
+
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass  # файл уже удалён или занят
+
+    return removed
+
+
+def sweep_snapshots(ttl: float, snapshots_dir: str = SNAPSHOTS_DIR) -> int:
+    """Снимки плейлистов, которые никто не выгружал дольше ttl, и опустевшие папки"""
+    removed = remove_stale_files([os.path.join(snapshots_dir, "*", "*.jsonl")], ttl)
+
+    for folder in glob.glob(os.path.join(snapshots_dir, "*")):
+        try:
+            if os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+        except OSError:
+            pass
+
+    return removed
@@ -0,0 +1,296 @@
+# scrape_service.py
+"""
+Общая «начинка» ботов: распознавание ссылок, запуск парсера, задачи пользователей
+и кэш плейлистов.
+
+Один ScrapeService на процесс: оба бота (см. runtime.py) парсят через него
+одним браузером (или пулом вкладок), а один и тот же плейлист в каждый момент
+парсится не больше одного раза. Кто пришёл за плейлистом во время парсинга,
+сначала получает уже найденные треки из JSONL-файла задания, затем новые вместе
+со всеми. Готовый результат лежит в кэше CACHE_TTL секунд.
+"""
+
+import asyncio
+import os
+import re
+import time
+from itertools import islice
+from typing import AsyncIterator, Optional
+
+from core.driver.get_playlist_tracks import GetPlaylistTracksClean
+from core.driver.janitor import remove_stale_files
+from core.driver.snapshots import latest_snapshot, playlist_id_from_url, save_snapshot
+from core.driver.track_sink import TrackFile
+
+# Регулярка для ссылок Яндекс Музыки
+YANDEX_LINK_PATTERN = re.compile(
+    r'https?://music\.yandex\.(ru|com)/playlists/'
+    r'(?:lk\.[a-f0-9\-]+|[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})'
+    r'(?:\?.*)?$',
+    re.IGNORECASE
+)
+
+# ----------------- КОНФИГ ПАРСЕРА (общий для всех ботов процесса) -----------------
+# Асинхронный CDP-парсер вместо Selenium (нужен Chrome/Chromium и aiohttp)
+USE_CDP_PARSER = False
+# Сколько вкладок общего Chrome для Selenium-парсинга (0 — один общий браузер)
+TAB_POOL_SIZE = 0
+# Сколько вкладок CDP-парсер открывает одновременно
+CDP_MAX_TABS = 4
+# Сколько секунд готовый плейлист отдаётся из кэша без нового парсинга
+CACHE_TTL = 30 * 60
+CACHE_DIR = "playlist_cache"
+# Размер пачки при «догоняющей» отдаче уже найденных треков
+REPLAY_BATCH = 200
+# Сколько секунд задание без подписчиков ещё живёт: повторная ссылка сразу после
+# отмены старой задачи пользователя подхватывает тот же парсинг
+CANCEL_GRACE = 5.0
+
+
+class UserTasks:
+    """Фоновые задачи пользователей одного бота: новая задача отменяет предыдущую"""
+
+    def __init__(self):
+        self.tasks = {}  # user_id -> asyncio.Task
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.tasks
+
+    def start(self, user_id, coro) -> asyncio.Task:
+        self.cancel(user_id)
+        task = asyncio.create_task(coro)
+        self.tasks[user_id] = task
+
+        def _forget(done_task):
+            # Удаляем запись, только если её не заменила более новая задача
+            if self.tasks.get(user_id) is done_task:
+                del self.tasks[user_id]
+
+        task.add_done_callback(_forget)
+        return task
+
+    def cancel(self, user_id) -> bool:
+        task = self.tasks.get(user_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def cancel_all(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+
+class ScrapeJob:
+    """Один парсинг плейлиста, на который подписаны все, кто его ждёт"""
+
+    def __init__(self, url: str, key: str):
+        self.url = url
+        self.key = key
+        self.file_prefix = os.path.join(CACHE_DIR, f"{key}_{int(time.time() * 1000)}")
+        self.path = f"{self.file_prefix}.jsonl"
+        # Снимок до этого парсинга и снимок, который сохранило само задание
+        self.previous_snapshot = latest_snapshot(url)
+        self.snapshot: Optional[str] = None
+
+        self.count = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Selenium-парсинг в потоке прервать нельзя — он доработает и попадёт в кэш
+        self.cancellable = USE_CDP_PARSER
+        self._subscribers = set()
+
+    def baseline_snapshot(self) -> Optional[str]:
+        """
+        С каким снимком сравнивать /new и экспорт «Новые»; звать при подписке.
+        Пока идёт парсинг — со снимком до него. Задание из кэша уже сохранило свой
+        снимок: его треки кому-то выгружены и новыми второй раз не считаются.
+        """
+        return self.snapshot or self.previous_snapshot
+
+    @property
+    def fresh(self) -> bool:
+        """Можно ли отдать задание новому подписчику без повторного парсинга"""
+        if not self.done:
+            return True
+        return self.error is None and time.time() - self.finished_at < CACHE_TTL
+
+    def publish(self, tracks: list):
+        self.count += len(tracks)
+        for queue in self._subscribers:
+            queue.put_nowait(tracks)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self.finished_at = time.time()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+
+    def _subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        if self.done:
+            queue.put_nowait(None)
+        return queue
+
+    def _unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        # Последний подписчик ушёл — если за CANCEL_GRACE никто не придёт, парсить незачем
+        if not self._subscribers and not self.done and self.cancellable and self.task:
+            asyncio.get_running_loop().call_later(CANCEL_GRACE, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self):
+        if not self._subscribers and not self.done and self.task:
+            self.task.cancel()
+
+    async def batches(self) -> AsyncIterator[list]:
+        """
+        Все пачки треков задания: сначала уже найденные (читаются из файла),
+        затем новые по мере появления. После ошибки парсинга поднимает её.
+        """
+        queue = self._subscribe()
+        replay = self.count
+        try:
+            if replay:
+                # Файл читаем в потоке по REPLAY_BATCH треков — большой плейлист
+                # из кэша не держит общий event loop
+                tracks = islice(TrackFile(self.path), replay)
+                while batch := await asyncio.to_thread(list, islice(tracks, REPLAY_BATCH)):
+                    yield batch
+
+            while (tracks := await queue.get()) is not None:
+                yield tracks
+
+            if self.error:
+                raise self.error
+        finally:
+            self._unsubscribe(queue)
+
+    async def wait(self) -> "ScrapeJob":
+        """Ждёт окончания парсинга; после ошибки парсинга поднимает её"""
+        queue = self._subscribe()
+        try:
+            while await queue.get() is not None:
+                pass
+        finally:
+            self._unsubscribe(queue)
+
+        if self.error:
+            raise self.error
+        return self
+
+
+class ScrapeService:
+    """Планировщик парсингов: очередь на общий браузер, дедупликация и кэш по плейлисту"""
+
+    def __init__(self):
+        self.jobs = {}  # id плейлиста -> ScrapeJob
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def max_concurrent(self) -> int:
+        if USE_CDP_PARSER:
+            return CDP_MAX_TABS
+        # Один общий Selenium-драйвер нельзя отдавать двум парсингам сразу
+        return TAB_POOL_SIZE or 1
+
+    def get_job(self, url: str) -> ScrapeJob:
+        """Текущее или закэшированное задание по плейлисту; при необходимости запускает новое"""
+        key = playlist_id_from_url(url)
+        job = self.jobs.get(key)
+        if job is not None and job.fresh:
+            return job
+
+        if job is not None and not job._subscribers:
+            self._remove_files(job)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        job = ScrapeJob(url, key)
+        self.jobs[key] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: ScrapeJob):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        error = None
+        try:
+            async with self._slots:
+                await self._scrape(job)
+            if job.count:
+                job.snapshot = await asyncio.to_thread(save_snapshot, job.url, TrackFile(job.path))
+        except asyncio.CancelledError:
+            error = RuntimeError("Парсинг отменён: не осталось ожидающих")
+        except Exception as e:
+            print(f"Ошибка парсинга {job.url}: {e}")
+            error = e
+        finally:
+            job.finish(error)
+
+    async def _scrape(self, job: ScrapeJob):
+        params = dict(
+            id_tg_user=job.key,
+            playlist_url=job.url,
+            pause_after_scroll=5.0,
+            step_size=900,
+            save_files=False,
+            stream=True,
+            file_prefix=job.file_prefix,
+        )
+
+        if USE_CDP_PARSER:
+            from core.driver.cdp_parser import AsyncGetPlaylistTracks
+            # on_tracks вызывается прямо в event loop
+            await AsyncGetPlaylistTracks(on_tracks=job.publish, **params).run()
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def on_tracks(tracks):
+            # Из потока парсера — передаём пачку в event loop
+            loop.call_soon_threadsafe(job.publish, tracks)
+
+        if TAB_POOL_SIZE > 0:
+            from core.driver.tab_pool import get_shared_tab_pool
+
+            def run_in_tab():
+                with get_shared_tab_pool(TAB_POOL_SIZE).lease() as tab:
+                    GetPlaylistTracksClean(on_tracks=on_tracks, driver=tab, **params)
+
+            await asyncio.to_thread(run_in_tab)
+        else:
+            await asyncio.to_thread(GetPlaylistTracksClean, on_tracks=on_tracks, **params)
+
+    def evict_expired(self) -> int:
+        """
+        Уборщик для Janitor: убирает из кэша устаревшие и неудачные задания.
+        Janitor зовёт его из своего потока, поэтому jobs обходим только по копии.
+        """
+        removed = 0
+        for key, job in list(self.jobs.items()):
+            if job.done and not job._subscribers and not job.fresh:
+                # get_job мог уже заменить задание свежим — его не трогаем
+                if self.jobs.get(key) is job:
+                    del self.jobs[key]
+                self._remove_files(job)
+                removed += 1
+
+        # Файлы заданий, вытесненных из кэша, пока их ещё кто-то читал
+        live = [job.path for job in list(self.jobs.values())]
+        removed += remove_stale_files([os.path.join(CACHE_DIR, "*.jsonl")], CACHE_TTL * 2, keep=live)
+        return removed
+
+    @staticmethod
+    def _remove_files(job: ScrapeJob):
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+
+# Единственный экземпляр на процесс — его используют оба бота
+scrape_service = ScrapeService()
@@ -0,0 +1,112 @@
+# scrape_trace.py
+"""
+Трасса одного парсинга: тайминги этапов по шагам скролла.
+
+Файл сохраняется в формате Chrome Trace Event — его можно открыть как таймлайн
+в chrome://tracing или https://ui.perfetto.dev. Шаги, Navigation Timing браузера
+и сводка по этапам лежат там же, в разделе "otherData".
+"""
+
+import json
+import os
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Тело функции для execute_script: Navigation/Paint timing и объём загруженных ресурсов
+JS_NAVIGATION_TIMING = """
+let nav = performance.getEntriesByType('navigation')[0];
+let resources = performance.getEntriesByType('resource');
+return JSON.stringify({
+    navigation: nav ? nav.toJSON() : performance.timing.toJSON(),
+    paint: Object.fromEntries(performance.getEntriesByType('paint').map(p => [p.name, p.startTime])),
+    resources: resources.length,
+    transfer_bytes: resources.reduce((sum, r) => sum + (r.transferSize || 0), 0)
+});
+"""
+
+
+class ScrapeTrace:
+    def __init__(self, name: str, **meta):
+        self.name = name
+        self.meta = meta
+        self.events = []
+        self.steps = []
+        self.navigation = None
+        self.cprofile_top = None
+
+        self._t0 = time.perf_counter()
+        self._started_at = time.time()
+        self._current_step = {}
+        self._totals = defaultdict(float)
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._t0) * 1_000_000
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """Замеряет этап; в yield-нутый словарь можно дописать данные (например, bytes)"""
+        start = self._now_us()
+        try:
+            yield args
+        finally:
+            duration = self._now_us() - start
+            self.events.append({
+                "name": name, "ph": "X", "ts": round(start), "dur": round(duration),
+                "pid": 1, "tid": 1, "args": args,
+            })
+            self._totals[name] += duration / 1000
+            self._current_step[f"{name}_ms"] = round(duration / 1000, 1)
+            self._current_step.update({k: v for k, v in args.items() if k != "step"})
+
+    def add_step(self, **fields):
+        """Закрывает шаг: тайминги этапов с прошлого вызова + переданные поля"""
+        step = {**self._current_step, **fields}
+        self.steps.append(step)
+        self._current_step = {}
+
+        if "total_tracks" in fields:
+            self.events.append({
+                "name": "tracks", "ph": "C", "ts": round(self._now_us()), "pid": 1,
+                "args": {"total": fields["total_tracks"]},
+            })
+
+    def set_cprofile(self, profiler, limit: int = 25):
+        """Топ функций по cumulative time из cProfile"""
+        stats = pstats.Stats(profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        self.cprofile_top = [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "ncalls": ncalls,
+                "tottime": round(tottime, 4),
+                "cumtime": round(cumtime, 4),
+            }
+            for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "name": self.name,
+                "started_at": self._started_at,
+                **self.meta,
+                "summary": {
+                    "total_ms": round(self._now_us() / 1000, 1),
+                    "steps": len(self.steps),
+                    "stages_ms": {name: round(ms, 1) for name, ms in self._totals.items()},
+                },
+                "steps": self.steps,
+                "navigation": self.navigation,
+                "cprofile_top": self.cprofile_top,
+            },
+        }
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
@@ -0,0 +1,150 @@
+# snapshots.py
+"""
+Версионные снимки плейлистов и разница между ними.
+
+Снимки лежат в snapshots/<playlist_id>/<время>.jsonl — по одной записи трека
+{position, track_id, title, artists} в строке, в порядке плейлиста.
+"""
+
+import json
+import os
+import re
+from bisect import bisect_left
+from datetime import datetime
+from typing import Optional
+
+from core.driver.track_sink import TrackFile
+
+SNAPSHOTS_DIR = "snapshots"
+# Сколько последних снимков хранить на один плейлист
+MAX_SNAPSHOTS = 10
+
+PLAYLIST_ID_PATTERN = re.compile(r'/playlists/([^/?#]+)', re.IGNORECASE)
+# track_id строки без ссылки на трек — её номер в плейлисте (см. get_playlist_tracks)
+POSITIONAL_ID_PREFIX = "index:"
+
+
+def is_positional_id(track_id: str) -> bool:
+    """ID по номеру строки: после вставки выше им станет уже другой трек"""
+    return track_id.startswith(POSITIONAL_ID_PREFIX)
+
+
+def playlist_id_from_url(playlist_url: str) -> str:
+    """ID плейлиста из ссылки (lk.xxx или uuid)"""
+    match = PLAYLIST_ID_PATTERN.search(playlist_url)
+    if not match:
+        raise ValueError(f"Не удалось определить ID плейлиста: {playlist_url}")
+    return match.group(1).lower()
+
+
+def list_snapshots(playlist_id: str, snapshots_dir: str = SNAPSHOTS_DIR) -> list:
+    """Пути ко всем снимкам плейлиста, от старых к новым"""
+    folder = os.path.join(snapshots_dir, playlist_id)
+    if not os.path.isdir(folder):
+        return []
+    names = sorted(name for name in os.listdir(folder) if name.endswith('.jsonl'))
+    return [os.path.join(folder, name) for name in names]
+
+
+def latest_snapshot(playlist_url: str, snapshots_dir: str = SNAPSHOTS_DIR) -> Optional[str]:
+    """Путь к последнему снимку плейлиста или None"""
+    snapshots = list_snapshots(playlist_id_from_url(playlist_url), snapshots_dir)
+    return snapshots[-1] if snapshots else None
+
+
+def save_snapshot(playlist_url: str, tracks, snapshots_dir: str = SNAPSHOTS_DIR) -> str:
+    """Сохраняет новый снимок и удаляет самые старые сверх MAX_SNAPSHOTS"""
+    playlist_id = playlist_id_from_url(playlist_url)
+    folder = os.path.join(snapshots_dir, playlist_id)
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, datetime.now().strftime("%Y%m%d_%H%M%S_%f") + ".jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        for track in tracks:
+            f.write(json.dumps(track, ensure_ascii=False) + "\n")
+
+    for old_path in list_snapshots(playlist_id, snapshots_dir)[:-MAX_SNAPSHOTS]:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+    return path
+
+
+def load_snapshot(path: str) -> TrackFile:
+    """Снимок как переобходимый итератор треков (файл читается построчно)"""
+    return TrackFile(path)
+
+
+def _longest_increasing_positions(sequence: list) -> set:
+    """Индексы элементов, образующих самую длинную возрастающую подпоследовательность (O(n log n))"""
+    tails = []       # последний элемент лучшей подпоследовательности каждой длины
+    tails_idx = []   # его индекс в sequence
+    parents = [-1] * len(sequence)
+
+    for i, value in enumerate(sequence):
+        pos = bisect_left(tails, value)
+        if pos == len(tails):
+            tails.append(value)
+            tails_idx.append(i)
+        else:
+            tails[pos] = value
+            tails_idx[pos] = i
+        parents[i] = tails_idx[pos - 1] if pos > 0 else -1
+
+    result = set()
+    i = tails_idx[-1] if tails_idx else -1
+    while i != -1:
+        result.add(i)
+        i = parents[i]
+    return result
+
+
+def diff_tracks(old_tracks, new_tracks) -> dict:
+    """
+    Разница между двумя снимками по track_id:
+    added — есть только в новом, removed — только в старом,
+    moved — общие треки, сменившие порядок относительно остальных.
+    Перемещёнными считаются треки вне самой длинной подпоследовательности,
+    сохранившей порядок, поэтому вставка одного трека не «двигает» все следующие.
+
+    Треки с ID по номеру строки (is_positional_id) не сравниваются: любая вставка
+    выше превратила бы их в «удалён + добавлен». Их число в новом снимке — unmatched.
+
+    Снимки обходятся дважды (подойдут списки или TrackFile); в памяти держатся
+    только ID и номера, а из записей — лишь попавшие в разницу.
+    """
+    old_positions = {}  # track_id -> (порядковый номер, position)
+    for i, track in enumerate(old_tracks):
+        if not is_positional_id(track["track_id"]):
+            old_positions[track["track_id"]] = (i, track["position"])
+
+    added = []
+    new_ids = set()
+    unmatched = 0
+    common_order = []  # порядковые номера в старом снимке общих треков, в новом порядке
+    for track in new_tracks:
+        if is_positional_id(track["track_id"]):
+            unmatched += 1
+            continue
+        new_ids.add(track["track_id"])
+        if track["track_id"] in old_positions:
+            common_order.append(old_positions[track["track_id"]][0])
+        else:
+            added.append(track)
+
+    removed = [track for track in old_tracks
+               if track["track_id"] not in new_ids and not is_positional_id(track["track_id"])]
+
+    stable = _longest_increasing_positions(common_order)
+    moved = []
+    common_index = 0
+    for track in new_tracks:
+        if track["track_id"] not in old_positions:
+            continue
+        if common_index not in stable:
+            moved.append({**track, "old_position": old_positions[track["track_id"]][1]})
+        common_index += 1
+
+    return {"added": added, "removed": removed, "moved": moved, "unmatched": unmatched}
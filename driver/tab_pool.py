@@ -0,0 +1,202 @@
+# tab_pool.py
+"""
+Несколько парсингов в одном Chrome: каждый парсинг арендует отдельное окно-вкладку.
+
+Selenium выполняет команды только в «текущем» окне, поэтому каждая вкладка
+переключается на себя под замком своего браузера перед каждым вызовом.
+Сами паузы парсера (time.sleep) идут без замка, так что вкладки работают параллельно.
+"""
+
+import math
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from core.driver.chrome_chromedriver_test import MyDriver
+from core.driver.get_playlist_tracks import Startparser
+
+
+class MultiTabDriver(MyDriver):
+    """Chrome, который не «усыпляет» фоновые окна — иначе Virtuoso в них не подгружает треки"""
+
+    def _setup_options(self) -> None:
+        super()._setup_options()
+        self.options.add_argument('--disable-background-timer-throttling')
+        self.options.add_argument('--disable-backgrounding-occluded-windows')
+        self.options.add_argument('--disable-renderer-backgrounding')
+
+
+class _Browser:
+    def __init__(self, tabs: int):
+        self.driver = MultiTabDriver().get_driver
+        self.lock = threading.RLock()
+        self.tabs = tabs      # сколько вкладок пула живёт в этом Chrome
+        self.alive = True     # False — браузер пересоздан, его вкладки больше не выдаются
+
+
+class TabDriver:
+    """
+    Вкладка общего Chrome с тем же интерфейсом, что нужен парсеру от драйвера:
+    get, execute_script, page_source.
+    """
+
+    def __init__(self, browser: _Browser, handle: str):
+        self.browser = browser
+        self.handle = handle
+
+    def _activate(self):
+        if self.browser.driver.current_window_handle != self.handle:
+            self.browser.driver.switch_to.window(self.handle)
+
+    def get(self, url: str):
+        # Не ждём загрузки под замком (как делает driver.get) — парсер сам выжидает паузу
+        with self.browser.lock:
+            self._activate()
+            self.browser.driver.execute_script("window.location.assign(arguments[0]);", url)
+
+    def execute_script(self, script: str, *args):
+        with self.browser.lock:
+            self._activate()
+            return self.browser.driver.execute_script(script, *args)
+
+    @property
+    def page_source(self) -> str:
+        with self.browser.lock:
+            self._activate()
+            return self.browser.driver.page_source
+
+
+class TabPool:
+    """
+    Пул вкладок: size вкладок, не больше tabs_per_browser в одном Chrome.
+    После каждой аренды вкладка закрывается и заменяется новой, чтобы
+    следующий парсинг не наследовал DOM и память предыдущего.
+    Cookies и кэш у вкладок одного браузера общие.
+    Если Chrome упал, он перезапускается целиком вместе со всеми своими вкладками.
+    """
+
+    def __init__(self, size: int = 4, tabs_per_browser: int = 4):
+        self.size = size
+        self.browsers = []
+        self._free = queue.Queue()
+        self._restart_lock = threading.Lock()
+
+        for i in range(math.ceil(size / tabs_per_browser)):
+            self._start_browser(min(tabs_per_browser, size - i * tabs_per_browser))
+
+    def _start_browser(self, tabs: int):
+        browser = _Browser(tabs)
+        self.browsers.append(browser)
+        with browser.lock:
+            self._free.put(TabDriver(browser, browser.driver.current_window_handle))
+            for _ in range(tabs - 1):
+                browser.driver.switch_to.new_window('window')
+                self._free.put(TabDriver(browser, browser.driver.current_window_handle))
+
+    def _restart_browser(self, browser: _Browser):
+        """Закрывает упавший Chrome и открывает вместо него новый с тем же числом вкладок"""
+        with self._restart_lock:
+            if not browser.alive:
+                return  # уже пересоздан по другой вкладке
+            browser.alive = False
+            self.browsers.remove(browser)
+            try:
+                browser.driver.quit()
+            except Exception:
+                pass
+            print(f"Chrome недоступен — перезапускаю (вкладок: {browser.tabs})")
+            self._start_browser(browser.tabs)
+
+    def acquire(self, timeout: Optional[float] = None) -> TabDriver:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            tab = self._free.get(timeout=remaining)
+            # Вкладки пересозданного браузера в очереди ещё могли остаться — пропускаем
+            if tab.browser.alive:
+                return tab
+
+    def release(self, tab: TabDriver, broken: bool = False):
+        if not tab.browser.alive:
+            return  # браузер уже заменён, взамен этой вкладки открыта новая
+
+        # Ошибка парсинга ещё не значит, что упал Chrome: соседние вкладки могут работать
+        if not broken or self._responds(tab.browser):
+            recycled = self._recycle(tab)
+            if recycled is not None:
+                self._free.put(recycled)
+                return
+
+        try:
+            self._restart_browser(tab.browser)
+        except Exception as e:
+            print(f"Не удалось перезапустить Chrome: {e}")
+
+    @staticmethod
+    def _responds(browser: _Browser) -> bool:
+        try:
+            with browser.lock:
+                browser.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        tab = self.acquire(timeout)
+        try:
+            yield tab
+        finally:
+            self.release(tab)
+
+    def _recycle(self, tab: TabDriver) -> Optional[TabDriver]:
+        """Закрывает отработавшую вкладку и открывает на её месте чистую; None — браузер недоступен"""
+        driver = tab.browser.driver
+        with tab.browser.lock:
+            try:
+                driver.switch_to.window(tab.handle)
+                driver.switch_to.new_window('window')
+                new_handle = driver.current_window_handle
+                driver.switch_to.window(tab.handle)
+                driver.close()
+                driver.switch_to.window(new_handle)
+                return TabDriver(tab.browser, new_handle)
+            except Exception as e:
+                print(f"Не удалось пересоздать вкладку, очищаю её: {e}")
+                try:
+                    driver.switch_to.window(tab.handle)
+                    driver.get("about:blank")
+                except Exception:
+                    return None
+                return tab
+
+    def close(self):
+        for browser in list(self.browsers):
+            try:
+                browser.driver.quit()
+            except Exception:
+                pass
+
+
+_shared_pool: Optional[TabPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_tab_pool(size: int = 4, tabs_per_browser: int = 4) -> TabPool:
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = TabPool(size, tabs_per_browser)
+        return _shared_pool
+
+
+def StartparserInTab(playlist_url: str, id_tg_user: int,
+                     on_tracks: Optional[Callable[[list], None]] = None,
+                     pool_size: int = 4, stream: bool = False):
+    """
+    Startparser во вкладке общего пула: ждёт свободную вкладку, парсит, возвращает её в пул.
+    """
+    with get_shared_tab_pool(pool_size).lease() as tab:
+        Startparser(playlist_url, id_tg_user, on_tracks, driver=tab, stream=stream)
@@ -0,0 +1,123 @@
+# track_sink.py
+"""
+Потоковое хранение треков в JSONL: одна запись {position, track_id, title, artists} в строке.
+Парсер дописывает треки по мере сбора, а боты и экспорт читают их итератором,
+не загружая весь плейлист в память.
+
+Рядом с файлом можно вести индекс <файл>.idx — смещение начала каждой строки
+(8 байт на трек). С ним TrackFile.get/get_range сразу переходят к нужному треку,
+а не перечитывают файл с начала.
+"""
+
+import json
+import struct
+from itertools import islice
+from typing import Iterator, Optional
+
+INDEX_SUFFIX = ".idx"
+_OFFSET = struct.Struct("<Q")
+
+
+def index_path(path: str) -> str:
+    """Путь к индексу смещений JSONL-файла"""
+    return path + INDEX_SUFFIX
+
+
+class JsonlTrackSink:
+    """
+    Дописывает пачки треков в JSONL-файл; после каждой пачки данные сброшены на диск.
+    С index=True ведёт ещё и индекс смещений (см. index_path).
+    """
+
+    def __init__(self, path: str, append: bool = False, index: bool = False):
+        self.path = path
+        self.count = 0
+        mode = 'ab' if append else 'wb'
+        self._file = open(path, mode)
+        self._offset = self._file.tell()
+        self._index = open(index_path(path), mode) if index else None
+
+    def write(self, tracks):
+        offsets = []
+        for track in tracks:
+            line = (json.dumps(track, ensure_ascii=False) + "\n").encode('utf-8')
+            self._file.write(line)
+            offsets.append(self._offset)
+            self._offset += len(line)
+            self.count += 1
+        self._file.flush()
+
+        # Индекс — после данных: читатель по индексу видит только дописанные строки
+        if self._index:
+            self._index.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+            self._index.flush()
+
+    def close(self):
+        for f in (self._file, self._index):
+            if f and not f.closed:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_tracks(path: str) -> Iterator[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TrackFile:
+    """
+    JSONL-файл треков, который можно обходить сколько угодно раз.
+    Каждый обход заново читает файл, в памяти держится одна запись.
+    Если рядом есть индекс смещений, get/get_range читают только нужные строки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter_tracks(self.path)
+
+    def get(self, index: int) -> Optional[dict]:
+        """Трек по индексу (0 — первый) или None, если треков меньше"""
+        tracks = self.get_range(index, index + 1)
+        return tracks[0] if tracks else None
+
+    def get_range(self, start: int, stop: int) -> list:
+        """Треки с индексами start..stop-1: через индекс или одним проходом по файлу"""
+        tracks = self._read_indexed(start, stop)
+        if tracks is None:
+            tracks = list(islice(iter_tracks(self.path), start, stop))
+        return tracks
+
+    def _read_indexed(self, start: int, stop: int) -> Optional[list]:
+        """Треки start..stop-1 по индексу смещений; None, если индекса нет"""
+        try:
+            index = open(index_path(self.path), 'rb')
+        except FileNotFoundError:
+            return None
+
+        with index:
+            # Недописанная запись индекса (файл растёт прямо сейчас) не в счёт
+            index.seek(0, 2)
+            available = index.tell() // _OFFSET.size
+            stop = min(stop, available)
+            if start >= stop:
+                return []
+            index.seek(start * _OFFSET.size)
+            (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+
+        # Строки после первой идут подряд — читаем их без индекса
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return [json.loads(f.readline()) for _ in range(stop - start)]
+
+    def count(self) -> int:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return sum(1 for line in f if line.strip())
@@ -0,0 +1,547 @@
+"""
+Нагрузочный тест обоих ботов против локального фейкового Telegram Bot API.
+
+Поднимает aiohttp-сервер, который отвечает на sendMessage, editMessageText,
+deleteMessage, sendDocument, answerCallbackQuery, getMe и getUpdates, направляет
+в него ботов (через TelegramAPIServer) и имитирует тысячи пользователей:
+ссылки на плейлисты, аудио-ответы для bot_1 и выбор формата для bot_2.
+Парсер заменён заглушкой, которая «находит» треки пачками с заданной паузой.
+
+Отчёт: время обработки апдейтов хендлерами (p50/p90/p99), время до ответа
+пользователю, пропускная способность, вызовы Bot API и время/блокировки SQLite.
+
+Примеры:
+    python loadtest.py --users 2000 --rate 200
+    python loadtest.py --mode webhook --users 5000 --rate 1000 --audio 5 --json report.json
+    python loadtest.py --db-writers 2     # плюс фоновые писатели в bot_progress.db
+    python loadtest.py --paged 1 --audio 20   # bot_1 в постраничном режиме (/paged)
+"""
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+BOT1_TOKEN = "1000001:loadtest-bot-one"
+BOT2_TOKEN = "1000002:loadtest-bot-two"
+
+# Функции bot_1, которые ходят в SQLite — их время и блокировки попадают в отчёт
+DB_FUNCTIONS = ["get_progress", "update_progress", "advance_progress", "reset_progress",
+                "get_page_size", "set_page_size",
+                "save_bot_message", "get_bot_messages", "clear_bot_messages"]
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p90/p99/max в миллисекундах"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50": pick(0.50), "p90": pick(0.90),
+            "p99": pick(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+
+# ----------------- Фейковый Bot API -----------------
+class FakeBotAPI:
+    """Минимальный Bot API: очереди апдейтов для getUpdates и «входящие» каждого чата"""
+
+    def __init__(self):
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.updates = defaultdict(asyncio.Queue)   # токен -> апдейты для getUpdates
+        self.inboxes = defaultdict(asyncio.Queue)   # (токен, chat_id) -> сообщения бота
+        self.calls = Counter()                      # метод -> сколько раз вызван
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def inbox(self, token: str, chat_id: int) -> asyncio.Queue:
+        return self.inboxes[(token, chat_id)]
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(token, data))
+
+        if method == "getMe":
+            bot_id = int(token.split(":")[0])
+            return self._ok({"id": bot_id, "is_bot": True, "first_name": "Loadtest",
+                             "username": f"loadtest_{bot_id}_bot"})
+
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            chat_id = int(data["chat_id"])
+            message_id = int(data["message_id"]) if "message_id" in data else next(self._message_ids)
+            text = data.get("text") or data.get("caption") or ""
+            self.inbox(token, chat_id).put_nowait({
+                "method": method, "message_id": message_id, "text": text,
+                "reply_markup": "reply_markup" in data,
+            })
+            return self._ok({"message_id": message_id, "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"}, "text": text})
+
+        # deleteMessage, answerCallbackQuery, setWebhook, deleteWebhook и прочее
+        return self._ok(True)
+
+    async def _get_updates(self, token: str, data) -> list:
+        queue = self.updates[token]
+        try:
+            first = await asyncio.wait_for(queue.get(), timeout=float(data.get("timeout") or 0) or 0.01)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        limit = int(data.get("limit") or 100)
+        while len(batch) < limit and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+
+# ----------------- Апдейты и замеры -----------------
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def message(self, user_id: int, **content) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                **content,
+            },
+        }
+
+    def audio(self, user_id: int) -> dict:
+        file_id = f"audio{user_id}_{random.randrange(1 << 30)}"
+        return self.message(user_id, audio={"file_id": file_id, "file_unique_id": file_id, "duration": 180})
+
+    def callback(self, user_id: int, data: str, message_id: int, bot_id: int) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": bot_id, "is_bot": True, "first_name": "Loadtest"},
+                    "text": "stats",
+                },
+            },
+        }
+
+
+def update_kind(update) -> str:
+    if update.callback_query:
+        return "callback"
+    message = update.message
+    if message is None:
+        return update.event_type
+    if message.audio or message.voice:
+        return "audio"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    if message.text and "music.yandex" in message.text:
+        return "link"
+    return "other"
+
+
+class Metrics:
+    def __init__(self):
+        self.handler = defaultdict(list)   # (бот, тип) -> время обработки апдейта, с
+        self.delivery = defaultdict(list)  # бот -> от отправки апдейта до входа в хендлер
+        self.reply = defaultdict(list)     # (бот, тип) -> от апдейта до ответа бота
+        self.errors = Counter()            # (бот, тип) -> исключения в хендлерах
+        self.timeouts = Counter()          # (бот, тип) -> ответа так и не дождались
+        self.db = defaultdict(list)        # функция -> время вызова
+        self.db_locked = 0
+        self.db_writer_ops = 0
+        self.sent_at = {}                  # update_id -> perf_counter при отправке
+
+    def middleware(self, bot_name: str):
+        async def measure(handler, update, data):
+            start = time.perf_counter()
+            sent = self.sent_at.pop(update.update_id, None)
+            if sent is not None:
+                self.delivery[bot_name].append(start - sent)
+
+            kind = update_kind(update)
+            try:
+                return await handler(update, data)
+            except Exception:
+                self.errors[(bot_name, kind)] += 1
+                raise
+            finally:
+                self.handler[(bot_name, kind)].append(time.perf_counter() - start)
+
+        return measure
+
+    def instrument_db(self, module):
+        """Оборачивает SQLite-функции модуля: хендлеры берут их из глобалов модуля при вызове"""
+        for name in DB_FUNCTIONS:
+            original = getattr(module, name)
+
+            def wrapped(*args, _original=original, _name=name, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if "locked" in str(e):
+                        self.db_locked += 1
+                    raise
+                finally:
+                    self.db[_name].append(time.perf_counter() - start)
+
+            setattr(module, name, wrapped)
+
+
+# ----------------- Нагрузка -----------------
+class LoadTest:
+    def __init__(self, args, bot_1, bot_2, server: FakeBotAPI):
+        self.args = args
+        self.bots = {"bot_1": bot_1, "bot_2": bot_2}
+        self.tokens = {"bot_1": BOT1_TOKEN, "bot_2": BOT2_TOKEN}
+        self.server = server
+        self.factory = UpdateFactory()
+        self.metrics = Metrics()
+        self.playlists = [f"https://music.yandex.ru/playlists/lk.{i:08x}-0000-0000-0000-000000000000"
+                          for i in range(args.playlists)]
+        self._webhook_tasks = set()
+
+    def send(self, bot_name: str, update: dict) -> float:
+        sent = time.perf_counter()
+        self.metrics.sent_at[update["update_id"]] = sent
+
+        if self.args.mode == "webhook":
+            # Как делает обработчик вебхука: апдейт сразу в диспетчер, каждый в своей задаче
+            module = self.bots[bot_name]
+            task = asyncio.create_task(module.dp.feed_raw_update(module.bot, update))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+        else:
+            self.server.updates[self.tokens[bot_name]].put_nowait(update)
+        return sent
+
+    async def expect(self, bot_name: str, kind: str, user_id: int, sent: float, predicate=None):
+        """Ждёт сообщение бота, подходящее под predicate, и записывает время до него"""
+        inbox = self.server.inbox(self.tokens[bot_name], user_id)
+        deadline = sent + self.args.reply_timeout
+        while True:
+            try:
+                message = await asyncio.wait_for(inbox.get(), timeout=max(0.0, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                self.metrics.timeouts[(bot_name, kind)] += 1
+                return None
+            if predicate is None or predicate(message):
+                self.metrics.reply[(bot_name, kind)].append(time.perf_counter() - sent)
+                return message
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def bot1_user(self, user_id: int):
+        """
+        Ссылка → первый трек → несколько аудио-ответов, на каждый ждём следующий трек.
+        В постраничном режиме (/paged) вместо аудио листает страницы кнопкой.
+        """
+        paged = random.random() < self.args.paged
+        if paged:
+            sent = self.send("bot_1", self.factory.message(user_id, text=f"/paged {self.args.page_size}"))
+            if await self.expect("bot_1", "command", user_id, sent) is None:
+                return
+
+        url = random.choice(self.playlists)
+        sent = self.send("bot_1", self.factory.message(user_id, text=url))
+        first = await self.expect("bot_1", "link", user_id, sent, lambda m: m["text"].startswith("Трек"))
+        if first is None:
+            return
+
+        inbox = self.server.inbox(BOT1_TOKEN, user_id)
+        if paged:
+            # Столько же треков, сколько «прослушивают» аудио-ответами, но страницами
+            bot_id = int(BOT1_TOKEN.split(":")[0])
+            for _ in range(max(1, self.args.audio // self.args.page_size)):
+                await asyncio.sleep(random.uniform(0, self.args.think))
+                self._drain(inbox)
+                update = self.factory.callback(user_id, f"page_next:{self.args.page_size}", first["message_id"], bot_id)
+                sent = self.send("bot_1", update)
+                edited = await self.expect("bot_1", "callback", user_id, sent,
+                                           lambda m: m["method"] == "editMessageText")
+                if edited is None:
+                    return
+            return
+
+        for _ in range(self.args.audio):
+            await asyncio.sleep(random.uniform(0, self.args.think))
+            self._drain(inbox)
+            sent = self.send("bot_1", self.factory.audio(user_id))
+            if await self.expect("bot_1", "audio", user_id, sent) is None:
+                return
+
+    async def bot2_user(self, user_id: int):
+        """Ссылка → сообщение со статистикой и кнопками → выбор формата → документ"""
+        url = random.choice(self.playlists)
+        sent = self.send("bot_2", self.factory.message(user_id, text=url))
+        stats = await self.expect("bot_2", "link", user_id, sent, lambda m: m["reply_markup"])
+        if stats is None:
+            return
+
+        await asyncio.sleep(random.uniform(0, self.args.think))
+        bot_id = int(BOT2_TOKEN.split(":")[0])
+        update = self.factory.callback(user_id, random.choice(["format_txt", "format_json", "format_all"]),
+                                       stats["message_id"], bot_id)
+        sent = self.send("bot_2", update)
+        await self.expect("bot_2", "callback", user_id, sent, lambda m: m["method"] == "sendDocument")
+
+    async def run_users(self) -> float:
+        user_ids = itertools.count(10_000_000)
+        tasks = []
+        started = time.perf_counter()
+
+        for i in range(self.args.users):
+            scenario = self.bot1_user if i % 2 == 0 else self.bot2_user
+            tasks.append(asyncio.create_task(scenario(next(user_ids))))
+            await asyncio.sleep(1 / self.args.rate)
+
+        await asyncio.gather(*tasks)
+        if self._webhook_tasks:
+            await asyncio.gather(*self._webhook_tasks, return_exceptions=True)
+        return time.perf_counter() - started
+
+
+def install_fake_scraper(scrape_service_module, args):
+    """Заглушка парсера: пачки синтетических треков в JSONL задания с паузой между ними"""
+    from core.driver.track_sink import JsonlTrackSink
+
+    async def fake_scrape(self, job):
+        with JsonlTrackSink(job.path) as sink:
+            for start in range(0, args.tracks, args.scrape_batch):
+                await asyncio.sleep(args.scrape_delay)
+                tracks = [
+                    {"position": i + 1, "track_id": f"{job.key}:{i}",
+                     "title": f"Track {i}", "artists": "Load Test"}
+                    for i in range(start, min(start + args.scrape_batch, args.tracks))
+                ]
+                sink.write(tracks)
+                job.publish(tracks)
+
+    scrape_service_module.ScrapeService._scrape = fake_scrape
+    scrape_service_module.CACHE_TTL = args.cache_ttl
+
+
+def start_db_writers(update_progress, metrics: Metrics, count: int, stop: threading.Event) -> list:
+    """Фоновые писатели в ту же базу — как второй процесс бота или внешний скрипт"""
+
+    def writer(n):
+        # Около 100 записей в секунду на писателя
+        while not stop.wait(0.01):
+            try:
+                update_progress(-1 - n, 0, 0, "loadtest")
+                metrics.db_writer_ops += 1
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e):
+                    metrics.db_locked += 1
+
+    threads = [threading.Thread(target=writer, args=(n,), daemon=True) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def build_report(test: LoadTest, duration: float) -> dict:
+    metrics = test.metrics
+    handled = sum(len(samples) for samples in metrics.handler.values())
+    db_total = sum(sum(samples) for samples in metrics.db.values())
+    return {
+        "mode": test.args.mode,
+        "users": test.args.users,
+        "duration_s": round(duration, 2),
+        "updates_handled": handled,
+        "updates_per_s": round(handled / duration, 1) if duration else 0,
+        "handlers": {f"{bot}/{kind}": percentiles(samples) for (bot, kind), samples in sorted(metrics.handler.items())},
+        "handler_errors": {f"{bot}/{kind}": count for (bot, kind), count in metrics.errors.items()},
+        "delivery": {bot: percentiles(samples) for bot, samples in sorted(metrics.delivery.items())},
+        "reply": {f"{bot}/{kind}": percentiles(samples) for (bot, kind), samples in sorted(metrics.reply.items())},
+        "reply_timeouts": {f"{bot}/{kind}": count for (bot, kind), count in metrics.timeouts.items()},
+        "bot_api_calls": dict(test.server.calls.most_common()),
+        "sqlite": {
+            "calls": {name: percentiles(samples) for name, samples in sorted(metrics.db.items())},
+            "total_s": round(db_total, 3),
+            # SQLite-вызовы синхронные — всё это время event loop стоит
+            "event_loop_share": round(db_total / duration, 3) if duration else 0,
+            "locked_errors": metrics.db_locked,
+            "background_writes": metrics.db_writer_ops,
+        },
+    }
+
+
+def print_report(report: dict):
+    def table(title, rows):
+        print(f"\n== {title} ==")
+        print(f"{'':<22}{'count':>8}{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+        for name, stats in rows.items():
+            if stats.get("count"):
+                print(f"{name:<22}{stats['count']:>8}{stats['p50']:>10}{stats['p90']:>10}"
+                      f"{stats['p99']:>10}{stats['max']:>10}")
+
+    print(f"\nРежим: {report['mode']}, пользователей: {report['users']}, время: {report['duration_s']} с")
+    print(f"Обработано апдейтов: {report['updates_handled']} ({report['updates_per_s']}/с)")
+
+    table("Хендлеры: время обработки апдейта", report["handlers"])
+    table("Доставка: апдейт → вход в хендлер", report["delivery"])
+    table("Ответ пользователю: апдейт → нужное сообщение бота", report["reply"])
+    if report["handler_errors"]:
+        print(f"Ошибки в хендлерах: {report['handler_errors']}")
+    if report["reply_timeouts"]:
+        print(f"Не дождались ответа: {report['reply_timeouts']}")
+
+    print("\n== Bot API ==")
+    for method, count in report["bot_api_calls"].items():
+        print(f"{method:<22}{count:>8}  ({count / report['duration_s']:.1f}/с)")
+
+    sqlite = report["sqlite"]
+    table("SQLite (bot_1)", sqlite["calls"])
+    print(f"Всего в SQLite: {sqlite['total_s']} с — {sqlite['event_loop_share'] * 100:.1f}% времени event loop")
+    print(f"database is locked: {sqlite['locked_errors']}, фоновых записей: {sqlite['background_writes']}")
+
+
+async def run(args) -> dict:
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    # Токены до импорта ботов: Bot() проверяет формат токена при создании
+    os.environ["BOT1_TOKEN"] = BOT1_TOKEN
+    os.environ["BOT2_TOKEN"] = BOT2_TOKEN
+    bot_1 = importlib.import_module("bot_1")
+    bot_2 = importlib.import_module("bot_2")
+    scrape_service = importlib.import_module("core.driver.scrape_service")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    install_fake_scraper(scrape_service, args)
+
+    server = FakeBotAPI()
+    base_url = await server.start()
+    api = TelegramAPIServer.from_base(base_url)
+
+    test = LoadTest(args, bot_1, bot_2, server)
+    for name, module in test.bots.items():
+        module.bot.session = AiohttpSession(api=api, limit=args.session_limit)
+        module.dp.update.outer_middleware(test.metrics.middleware(name))
+    # Фоновым писателям — исходная функция, чтобы их записи не смешивались с замерами бота
+    update_progress = bot_1.update_progress
+    test.metrics.instrument_db(bot_1)
+
+    stop_writers = threading.Event()
+    polling = []
+    for module in test.bots.values():
+        await module.on_startup()
+        if args.mode == "polling":
+            polling.append(asyncio.create_task(
+                module.dp.start_polling(module.bot, handle_signals=False, polling_timeout=1)
+            ))
+    start_db_writers(update_progress, test.metrics, args.db_writers, stop_writers)
+
+    try:
+        duration = await test.run_users()
+    finally:
+        stop_writers.set()
+        for module in test.bots.values():
+            if args.mode == "polling":
+                await module.dp.stop_polling()
+            await module.on_shutdown()
+        await asyncio.gather(*polling, return_exceptions=True)
+        for module in test.bots.values():
+            await module.bot.session.close()
+        await server.stop()
+
+    return build_report(test, duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест ботов против фейкового Bot API")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling",
+                        help="polling — через getUpdates фейкового API, webhook — апдейты прямо в диспетчер")
+    parser.add_argument("--users", type=int, default=1000, help="Сколько пользователей (поровну на ботов)")
+    parser.add_argument("--rate", type=float, default=100.0, help="Новых пользователей в секунду")
+    parser.add_argument("--audio", type=int, default=10, help="Аудио-ответов на пользователя bot_1")
+    parser.add_argument("--paged", type=float, default=0.0,
+                        help="Доля пользователей bot_1 в постраничном режиме (0..1)")
+    parser.add_argument("--page-size", type=int, default=10, help="Размер страницы для --paged")
+    parser.add_argument("--think", type=float, default=0.5, help="Максимальная пауза пользователя между действиями, с")
+    parser.add_argument("--playlists", type=int, default=50, help="Сколько разных плейлистов присылают")
+    parser.add_argument("--tracks", type=int, default=30, help="Треков в плейлисте-заглушке")
+    parser.add_argument("--scrape-batch", type=int, default=10, help="Треков в пачке заглушки парсера")
+    parser.add_argument("--scrape-delay", type=float, default=0.2, help="Пауза заглушки между пачками, с")
+    parser.add_argument("--cache-ttl", type=float, default=60.0, help="CACHE_TTL плейлистов на время теста, с")
+    parser.add_argument("--reply-timeout", type=float, default=60.0, help="Сколько ждать ответа бота, с")
+    parser.add_argument("--session-limit", type=int, default=100, help="Соединений к Bot API на бота")
+    parser.add_argument("--db-writers", type=int, default=0, help="Фоновых потоков-писателей в bot_progress.db")
+    parser.add_argument("--workdir", help="Рабочая папка (база, файлы); по умолчанию временная")
+    parser.add_argument("--json", help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    # Боты пишут базу и файлы в текущую папку — уводим их из рабочей копии
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    json_path = os.path.abspath(args.json) if args.json else None
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="loadtest_"))
+    print(f"Рабочая папка: {os.getcwd()}", file=sys.stderr)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
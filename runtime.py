@@ -0,0 +1,41 @@
+"""
+Оба бота в одном процессе и одном event loop.
+
+Боты по-прежнему можно запускать по отдельности (python bot_1.py / python bot_2.py),
+но тогда у каждого свой браузер и свой кэш. Здесь они делят один scrape_service:
+один Chrome (или пул вкладок), одну очередь парсингов и общий кэш плейлистов —
+ссылка, которую прислали обоим ботам, парсится один раз.
+
+Токены берутся из переменных окружения BOT1_TOKEN и BOT2_TOKEN.
+"""
+
+import asyncio
+
+import bot_1
+import bot_2
+
+# Модули ботов: в каждом module-level bot, dp, on_startup() и on_shutdown()
+BOTS = [bot_1, bot_2]
+
+
+async def main():
+    for module in BOTS:
+        await module.on_startup()
+
+    print(f"Запущено ботов: {len(BOTS)}")
+    try:
+        # Сигналы обрабатывает asyncio.run: при Ctrl+C отменяются все поллинги сразу
+        await asyncio.gather(*(
+            module.dp.start_polling(module.bot, handle_signals=False)
+            for module in BOTS
+        ))
+    finally:
+        for module in BOTS:
+            await module.on_shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass